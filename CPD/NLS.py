@@ -1,43 +1,17 @@
-from CPD.common_kernels import compute_number_of_variables,  flatten_Tensor, reshape_into_matrices,  get_residual
+from CPD.common_kernels import compute_number_of_variables,  flatten_Tensor, reshape_into_matrices
+from CPD.contraction import contract_rank_first, get_slab_contraction
+from CPD.gram_cache import GramCache
+from CPD.hessian import CP_HessianEngine
+from CPD.line_search import exact_line_search
+from CPD.residual import CP_ResidualEngine
+from als.dimension_tree import left_deep_tree
+from als.sweep_plan import SweepPlan
+from scipy.linalg.blas import get_blas_funcs
 from scipy.sparse.linalg import LinearOperator
 
 import scipy.sparse.linalg as spsalg
 import numpy as np
 
-try:
-    import Queue as queue
-except ImportError:
-    import queue
-
-def fast_hessian_contract_batch(tenpy,XX,AA,GG,GD,regu=1):
-    RR  = regu*XX
-    RR += tenpy.einsum("niz,nzr->nir",XX,GD)
-    if tenpy.name() == 'numpy':
-        RR += np.einsum("niz,pjr,npzr,pjz->nir",AA,AA,GG,XX,optimize=True)
-    else:
-        RR += tenpy.einsum("niz,pjr,npzr,pjz->nir",AA,AA,GG,XX)
-    return RR
-
-
-def fast_hessian_contract(tenpy,X,A,gamma,diag,regu=1):
-    N = len(A)
-    ret = []
-    for n in range(N):
-        ret.append(tenpy.zeros(A[n].shape))
-        for p in range(N):
-            if n==p:
-                ret[n] += tenpy.einsum("iz,zr->ir",X[p],gamma[n][p])
-            else:
-                ret[n] += tenpy.einsum("iz,zr,jr,jz->ir",A[n],gamma[n][p],A[p],X[p])
-        
-        if diag:
-            ret[n] += regu*tenpy.einsum('jj,ij->ij',gamma[n][n],X[n])
-            
-        else:
-            ret[n]+= regu*X[n]
-            
-    return ret
-
 def fast_block_diag_precondition(tenpy,X,P):
     N = len(X)
     ret = []
@@ -48,21 +22,71 @@ def fast_block_diag_precondition(tenpy,X,P):
         ret.append(Y)
     return ret
 
+class CGWorkspace():
+    """Preallocated vectors of the conjugate gradient solve of an NLS step.
+
+    Every vector is one contiguous buffer holding all the parameters, and its
+    per-mode matrices are reshaped views of that buffer. CG updates the flat
+    buffers in place with BLAS axpy and dot, while the Hessian and the
+    preconditioner read and write the views, so an iteration allocates no
+    parameter sized arrays. The 'trial' vector holds the Armijo trial point.
+    numpy only.
+
+    Attributes:
+        shapes (list): shapes of the factor matrices.
+        flat (dict): flat buffer of every vector by name.
+        views (dict): per-mode views of every flat buffer by name.
+
+    """
+    names = ('x', 'r', 'z', 'p', 'q', 'trial')
+
+    def __init__(self, A):
+        self.shapes = [Ai.shape for Ai in A]
+        dtype = np.result_type(*A)
+        size = sum(shape[0] * shape[1] for shape in self.shapes)
+        self.flat = {}
+        self.views = {}
+        for name in self.names:
+            buf = np.zeros(size, dtype=dtype)
+            self.flat[name] = buf
+            self.views[name] = self._split(buf)
+        self.axpy, self.dot = get_blas_funcs(('axpy', 'dot'), (buf,))
+
+    def _split(self, buf):
+        views = []
+        start = 0
+        for shape in self.shapes:
+            stop = start + shape[0] * shape[1]
+            views.append(buf[start:stop].reshape(shape))
+            start = stop
+        return views
+
+    def fits(self, A):
+        return [Ai.shape for Ai in A] == self.shapes
+
+
 class CP_fastNLS_Optimizer():
     """Fast Nonlinear Least Square Method for CP is a novel method of
     computing the CP decomposition of a tensor by utilizing tensor contractions
     and preconditioned conjugate gradient to speed up the process of solving
     damped Gauss-Newton problem of CP decomposition.
+
+    O is the nonzero pattern of a sparse T, with which the Armijo line search
+    evaluates its residuals. Those of a dense T are reconstructed one slab at
+    a time, so they stay within the memory budget.
     """
 
-    def __init__(self,tenpy,T,A,args=None):
+    def __init__(self,tenpy,T,A,args=None,O=None):
         self.tenpy = tenpy
         self.T = T
         self.A = A
+        self.O = O
         self.cg_tol = args.cg_tol
         self.num=args.num
         self.G = None
         self.gamma = None
+        # Grams with prefix/suffix Hadamard products, kept current by update_A
+        self.gram = GramCache(tenpy, A)
         self.atol = 0
         self.total_iters = 0
         self.maxiter = args.maxiter
@@ -76,83 +100,99 @@ class CP_fastNLS_Optimizer():
         self.c = args.c
         self.tau=args.tau
         self.arm_iter= args.arm_iters
+        self.exact_line = bool(getattr(args, 'exact_line', 0)) and not args.sp
+        self.normTsq = None
         self.delta = None
         self.sp = args.sp
-        
-
-
-    def _einstr_builder(self,M,s,ii):
-        ci = ""
-        nd = M.ndim
-        if len(s) != 1:
-            ci ="R"
-            nd = M.ndim-1
-
-        str1 = "".join([chr(ord('a')+j) for j in range(nd)])+ci
-        str2 = (chr(ord('a')+ii))+"R"
-        str3 = "".join([chr(ord('a')+j) for j in range(nd) if j != ii])+"R"
-        einstr = str1 + "," + str2 + "->" + str3
-        return einstr
+        # Hessian-vector products at the current gamma
+        self.hessian = None
+        # eigendecompositions of the diagonal gamma blocks and the gamma they
+        # belong to, see factor_block_diag
+        self.block_eig = None
+        self.block_eig_gamma = None
+        # flat CG vectors, allocated on the first numpy solve
+        self.workspace = None
+        # every step moves all factors after the gradient MTTKRPs are formed,
+        # so no exact MTTKRP of the current iterate is ever available
+        self.mttkrp = None
+        # dimension tree sweep of the gradient MTTKRPs, compiled on first use
+        self.plan = None
+        self.slabs = None
+        if not self.sp:
+            self.slabs = get_slab_contraction(tenpy, T, getattr(args, 'memory_budget', 0))
+        # residuals of the Armijo line search, streamed like the gradient
+        self.res_engine = None
+        if self.Arm and not self.exact_line:
+            self.res_engine = CP_ResidualEngine(tenpy, T, O, self.sp, slabs=self.slabs)
+        
+
+
+    def close(self):
+        """Release the threads of the optimizer at the end of a run.
+        """
+        if self.slabs is not None:
+            self.slabs.close()
+        if self.res_engine is not None:
+            self.res_engine.close()
+
+    def _compile_plan(self):
+        modes = list(range(len(self.A)))
+        R = self.A[0].shape[1]
+        dtype = np.result_type(self.T.dtype, self.A[0].dtype)
+        alloc = None
+        if self.tenpy.name() == 'numpy':
+            alloc = lambda shape: np.empty(shape, dtype=dtype)
+        plan = SweepPlan(left_deep_tree(modes), modes, lambda m: sorted(m, reverse=True),
+                         lambda m: (R,) + tuple(self.T.shape[j] for j in m),
+                         dtype.itemsize, alloc)
+        self.tenpy.printf("Gradient sweep plan has", plan.num_contractions, "contractions, peak intermediate memory",
+                          plan.peak_bytes / 2.**20, "MB, preallocated", plan.nbytes / 2.**20, "MB")
+        return plan
+
+    def _contract(self,modes,M,ii,out):
+        if M is self.T and self.slabs is not None:
+            return self.slabs.contract(modes.index(ii), self.A[ii], out)
+        return contract_rank_first(self.tenpy, M, modes.index(ii), self.A[ii],
+                                   M.ndim != len(modes), out)
 
     def compute_G(self):
-        G = []
-        for i in range(len(self.A)):
-            G.append(self.tenpy.einsum("ij,ik->jk",self.A[i],self.A[i]))
-        self.G = G
+        # only Grams of replaced factors are recomputed; in place updates go
+        # through update_A
+        self.gram.refresh(self.A)
+        self.G = self.gram.G
         
 
-    def compute_coefficient_matrix(self,n1,n2):
-        ret = self.tenpy.ones(self.G[0].shape)
-        for i in range(len(self.G)):
-            if i!=n1 and i!=n2:
-                ret = self.tenpy.einsum("ij,ij->ij",ret,self.G[i])
-        return ret
-
     def compute_gamma(self):
-        N = len(self.A)
-        result = []
-        for i in range(N):
-            result.append([])
-            for j in range(N):
-                if j>=i:
-                    M = self.compute_coefficient_matrix(i,j)
-                    result[i].append(M)
-                else:
-                    M = result[j][i]
-                    result[i].append(M)
-        self.gamma = result
+        self.gamma = self.return_gamma()
         
     def return_gamma(self):
-        N = len(self.A)
-        result = []
-        for i in range(N):
-            result.append([])
-            for j in range(N):
-                if j>=i:
-                    M = self.compute_coefficient_matrix(i,j)
-                    result[i].append(M)
-                else:
-                    M = result[j][i]
-                    result[i].append(M)
-        return result
+        return self.gram.hadamard_except_pairs()
         
 
     
-    def compute_block_diag_preconditioner(self,Regu):
-        P = []
+    def factor_block_diag(self):
+        # gamma[i][i] = V diag(w) V^T, so that (gamma[i][i] + Regu I)^-1 =
+        # V diag(w + Regu)^-1 V^T for any Regu. With diag the damping is
+        # Regu D for D the diagonal of gamma[i][i], and the block is scaled to
+        # D^-1/2 gamma[i][i] D^-1/2 = W diag(w) W^T first, giving V = D^-1/2 W.
+        self.block_eig = []
         for i in range(len(self.A)):
-            n = self.gamma[i][i].shape[0]
+            G = self.gamma[i][i]
             if self.diag:
-                U, s, V = self.tenpy.svd(self.gamma[i][i]+Regu*self.tenpy.diag(self.gamma[i][i].diagonal()))
+                d = G.diagonal()**-.5
+                w, V = self.tenpy.eigh(self.tenpy.einsum("i,ij,j->ij",d,G,d))
+                V = self.tenpy.einsum("i,ij->ij",d,V)
             else:
-                U, s, V = self.tenpy.svd(self.gamma[i][i]+Regu*self.tenpy.eye(n))
-            Pval_inv = self.tenpy.dot(
-                self.tenpy.transpose(V), 
-                self.tenpy.dot(
-                    self.tenpy.diag(s**-1), self.tenpy.transpose(U)
-                    )
-                )
-            P.append(Pval_inv)
+                w, V = self.tenpy.eigh(G)
+            self.block_eig.append((w,V))
+        self.block_eig_gamma = self.gamma
+
+    def compute_block_diag_preconditioner(self,Regu):
+        if self.block_eig_gamma is not self.gamma:
+            self.factor_block_diag()
+        P = []
+        for w, V in self.block_eig:
+            P.append(self.tenpy.einsum("ij,j,kj->ik",V,(w+Regu)**-1,V))
         return P
 
 
@@ -168,66 +208,40 @@ class CP_fastNLS_Optimizer():
                 lst[i] = self.A[i]
 
         else:
-            q = queue.Queue()
-            for i in range(len(self.A)):
-                q.put(i)
-            s = [(list(range(len(self.A))),self.T)]
-            while not q.empty():
-                i = q.get()
-                while i not in s[-1][0]:
-                    s.pop()
-                    assert(len(s) >= 1)
-                while len(s[-1][0]) != 1:
-                    M = s[-1][1]
-                    idx = s[-1][0].index(i)
-                    ii = len(s[-1][0])-1
-                    if idx == len(s[-1][0])-1:
-                        ii = len(s[-1][0])-2
-                    einstr = self._einstr_builder(M,s,ii)
-                    N = self.tenpy.einsum(einstr,M,self.A[ii])
-                    ss = s[-1][0][:]
-                    ss.remove(ii)
-                    s.append((ss,N))
-                M = s[-1][1]
-                g = M - self.A[i].dot(self.gamma[i][i])
-                grad.append(g)
+            if self.plan is None:
+                self.plan = self._compile_plan()
+            grad = [None] * len(self.A)
+            def leaf(i, M):
+                grad[i] = self.tenpy.transpose(M) - self.A[i].dot(self.gamma[i][i])
+            self.plan.run(self.T, self._contract, leaf)
         return grad
     
+    def hessian_engine(self):
+        if self.hessian is None or self.hessian.gamma is not self.gamma:
+            self.hessian = CP_HessianEngine(self.tenpy,self.A,self.gamma,self.diag)
+        return self.hessian
+
     def gradient_GG(self,g):
-        N = len(self.A)
-        s = self.A[0].shape[0]
-        R = self.A[0].shape[1]
-        
-        gg = self.tenpy.zeros((N,s,R))
-        
-        self.AA = self.tenpy.zeros((N,s,R))
-        self.GG = self.tenpy.zeros((N,N,R,R))
-        self.GD = self.tenpy.zeros((N,R,R))
-        
-        for n in range(N):
-            self.AA[n,:,:] = self.A[n]
-            gg[n,:,:] = g[n]
-            for p in range(N):
-                if n != p:
-                    self.GG[n,p,:,:] = self.gamma[n][p]
-                else:
-                    self.GD[n,:,:] = self.gamma[n][n]
-       
-        
-        return gg
+        # stacks are zero padded to the largest mode
+        H = self.hessian_engine()
+        if H.AA is None:
+            H.AA = H.stack(self.A)
+        self.AA = H.AA
+        self.GG = H.GG
+        self.GD = H.GD
+        return H.stack(g)
     
 
 
     def create_fast_hessian_contract_LinOp(self,Regu):
         num_var = compute_number_of_variables(self.A)
-        A = self.A
-        gamma = self.gamma
+        H = self.hessian_engine()
         tenpy = self.tenpy
         template = self.A
 
         def mv(delta):
             delta = reshape_into_matrices(tenpy,delta,template)
-            result = fast_hessian_contract(tenpy,delta,A,gamma,Regu)
+            result = H.matvec(delta,Regu)
             vec = flatten_Tensor(tenpy,result)
             return vec
 
@@ -235,10 +249,72 @@ class CP_fastNLS_Optimizer():
         return V
 
     def matvec(self,Regu,delta):
-        return fast_hessian_contract(self.tenpy,delta,self.A,self.gamma,self.diag,Regu)
+        return self.hessian_engine().matvec(delta,Regu)
     
     def matvec2(self,Regu,delta):
-        return fast_hessian_contract_batch(self.tenpy,delta,self.AA,self.GG,self.GD,Regu)
+        return self.hessian_engine().matvec_batch(delta,Regu)
+
+    def cg_workspace(self):
+        if self.workspace is None or not self.workspace.fits(self.A):
+            self.workspace = CGWorkspace(self.A)
+        return self.workspace
+
+    def _flat_conjugate_gradient(self,g,P,Regu):
+        # conjugate gradient on the flat workspace, preconditioned by the
+        # blocks P unless P is None; returns views of the workspace
+        ws = self.cg_workspace()
+        H = self.hessian_engine()
+        x, r, p, q = ws.flat['x'], ws.flat['r'], ws.flat['p'], ws.flat['q']
+        X, Rv, Pv, Q = ws.views['x'], ws.views['r'], ws.views['p'], ws.views['q']
+        if P is None:
+            z, Z = r, Rv
+        else:
+            z, Z = ws.flat['z'], ws.views['z']
+
+        x.fill(0)
+        for n in range(len(g)):
+            Rv[n][...] = g[n]
+        g_norm = np.sqrt(ws.dot(r,r))
+
+        tol = np.max([self.atol,np.min([self.cg_tol,np.sqrt(g_norm)])])*g_norm
+
+        if g_norm<tol:
+            return X,0
+
+        if P is not None:
+            for n in range(len(P)):
+                np.dot(Rv[n],P[n],out=Z[n])
+        p[...] = z
+        rz = ws.dot(r,z)
+
+        counter = 0
+        while True:
+            H.matvec(Pv,Regu,out=Q)
+
+            alpha = rz/ws.dot(p,q)
+
+            ws.axpy(p,x,a=alpha)
+            ws.axpy(q,r,a=-alpha)
+            counter += 1
+
+            if np.sqrt(ws.dot(r,r))<tol:
+                break
+
+            if P is not None:
+                for n in range(len(P)):
+                    np.dot(Rv[n],P[n],out=Z[n])
+
+            rz_new = ws.dot(r,z)
+            beta = rz_new/rz
+            rz = rz_new
+
+            p *= beta
+            p += z
+
+            if counter == self.maxiter:
+                break
+
+        return X,counter
 
     def fast_conjugate_gradient_batch(self,gg,Regu):
         #start = time.time()
@@ -279,13 +355,15 @@ class CP_fastNLS_Optimizer():
                 break
                 
         #self.tenpy.printf('cg took',end-start)
-        x = [XX[i,:,:] for i in range(N)]
+        x = self.hessian_engine().unstack(XX)
 
         return x,counter
 
 
     def fast_conjugate_gradient(self,g,Regu):
         #start = time.time()
+        if self.tenpy.name() == 'numpy':
+            return self._flat_conjugate_gradient(g,None,Regu)
 
         x = [self.tenpy.zeros(A.shape) for A in g]
         
@@ -337,6 +415,8 @@ class CP_fastNLS_Optimizer():
 
     def fast_precond_conjugate_gradient(self,g,P,Regu):
         #start = time.time()
+        if self.tenpy.name() == 'numpy':
+            return self._flat_conjugate_gradient(g,P,Regu)
         
         x = [self.tenpy.zeros(A.shape) for A in g]
         
@@ -407,10 +487,16 @@ class CP_fastNLS_Optimizer():
     def update_A(self,delta,alpha):
         for i in range(len(delta)):
             self.A[i] += alpha*delta[i]
+            self.gram.update(i,self.A[i])
 
     def update_temp(self,delta,alpha):
+        # temp = A + alpha*delta, in place in the workspace with numpy
         for i in range(len(delta)):
-            self.temp[i] += alpha*delta[i]
+            if self.tenpy.name() == 'numpy':
+                np.multiply(delta[i],alpha,out=self.temp[i])
+                self.temp[i] += self.A[i]
+            else:
+                self.temp[i] = self.A[i] + alpha*delta[i]
             
     
     def armijo_line(self,A_res,delta,g,alpha=1.0):
@@ -418,11 +504,9 @@ class CP_fastNLS_Optimizer():
         t= self.c*m
         for i in range(self.arm_iter):
             self.update_temp(delta,alpha)
-            if get_residual(self.tenpy,self.T,self.temp) - A_res  <= alpha*t:
+            if self.res_engine.explicit_residual(self.temp) - A_res  <= alpha*t:
                 break
             else:
-                for i in range(len(self.temp)):
-                    self.temp[i] = self.A[i].copy()
                 alpha = self.tau*alpha
 
         return alpha
@@ -445,13 +529,18 @@ class CP_fastNLS_Optimizer():
         self.atol = self.num*self.tenpy.list_vecnorm(self.delta)
         
         
-        self.temp = np.zeros_like(self.A)
-        
-        for i in range(len(self.delta)):
-            self.temp[i] = self.A[i].copy()
-            
-        if self.Arm:
-            A_res = get_residual(self.tenpy,self.T,self.A)
+        if self.exact_line:
+            if self.normTsq is None:
+                self.normTsq = self.tenpy.vecnorm(self.T)**2
+            alpha, _, _ = exact_line_search(self.tenpy,self.T,self.A,self.delta,self.normTsq,self.slabs)
+            self.update_A(self.delta,alpha)
+
+        elif self.Arm:
+            if self.tenpy.name() == 'numpy':
+                self.temp = self.cg_workspace().views['trial']
+            else:
+                self.temp = list(self.A)
+            A_res = self.res_engine.explicit_residual(self.A)
             alpha = self.armijo_line(A_res,self.delta,g)
             self.update_A(self.delta,alpha)
             
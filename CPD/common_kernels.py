@@ -105,6 +105,28 @@ def get_residual(tenpy,T,A):
     #tenpy.printf("Residual computation took",t1-t0,"seconds")
     return nrm
 
+def compute_mttkrp(tenpy,T,A,i):
+    T_inds = "".join([chr(ord('a')+j) for j in range(T.ndim)])
+    einstr = ""
+    A2 = []
+    for j in range(len(A)):
+        if j != i:
+            einstr += chr(ord('a')+j) + chr(ord('a')+T.ndim) + ','
+            A2.append(A[j])
+    einstr += T_inds + "->" + chr(ord('a')+i) + chr(ord('a')+T.ndim)
+    A2.append(T)
+    return tenpy.einsum(einstr,*A2)
+
+def get_residual_gram(tenpy,normTsq,A,M,i,H=None):
+    """Squared residual from ||T||^2 - 2<M,A[i]> + sum(H), where M is the MTTKRP
+    of T with respect to mode i and H is the Hadamard product of all A[j]^T A[j].
+    """
+    if H is None:
+        H = tenpy.dot(tenpy.transpose(A[0]),A[0])
+        for j in range(1,len(A)):
+            H *= tenpy.dot(tenpy.transpose(A[j]),A[j])
+    return normTsq - 2*tenpy.sum(M*A[i]) + tenpy.sum(H)
+
 def get_residual_sp(tenpy,O,T,A):
     t0 = time.time()
     K = tenpy.TTTP(O,A)
@@ -0,0 +1,201 @@
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from tensors.utils import slab_size, slabs
+
+
+def rank_first_einstr(modes, ii, has_rank):
+    """Einstein string contracting mode ii of a tensor with axes modes, preceded by
+    the rank axis if has_rank, with a factor matrix. The rank axis of the output
+    comes first.
+
+    Example:
+        rank_first_einstr([0,1,2], 2, True) == "Rabc,cR->Rab"
+        rank_first_einstr([0,1,2], 0, False) == "abc,aR->Rbc"
+
+    """
+    str1 = "".join([chr(ord('a') + j) for j in modes])
+    if has_rank:
+        str1 = "R" + str1
+    str2 = chr(ord('a') + ii) + "R"
+    str3 = "R" + "".join([chr(ord('a') + j) for j in modes if j != ii])
+    return str1 + "," + str2 + "->" + str3
+
+
+def contract_rank_first(tenpy, M, axis, A, has_rank, out=None):
+    """Contract one mode of a dimension tree tensor with a factor matrix.
+
+    Intermediates keep the rank axis first, so every contraction below the root
+    is a batch of matrix-vector or vector-matrix products over the rank, which
+    numpy hands to BLAS through matmul instead of an unoptimized einsum loop.
+    The root contraction is a single GEMM when the contracted axis is the first
+    or the last one. Other backends fall back to einsum.
+
+    Args:
+        M (tensor): tensor to contract, with the rank axis first if has_rank.
+        axis (int): axis of the contracted mode, not counting the rank axis.
+        A (matrix): factor matrix of the contracted mode.
+        has_rank (bool): whether M carries the rank axis.
+        out (tensor): optional contiguous buffer of the output shape the result
+            is written to, numpy only.
+
+    Returns:
+        (tensor) the contracted tensor, with the rank axis first.
+
+    """
+    if tenpy.name() != 'numpy':
+        ndim = M.ndim - 1 if has_rank else M.ndim
+        modes = list(range(ndim))
+        return tenpy.einsum(rank_first_einstr(modes, axis, has_rank), M, A)
+
+    n, R = A.shape
+    if not has_rank:
+        rest = M.shape[:axis] + M.shape[axis + 1:]
+        if axis == M.ndim - 1:
+            res = np.dot(A.T, M.reshape(-1, n).T, out=_view(out, (R, -1)))
+        elif axis == 0:
+            res = np.dot(A.T, M.reshape(n, -1), out=_view(out, (R, -1)))
+        else:
+            # tensordot takes no output buffer
+            return np.tensordot(A, M, axes=([0], [axis])).reshape((R,) + rest)
+        return res.reshape((R,) + rest)
+
+    shape = M.shape[1:]
+    pre = int(np.prod(shape[:axis]))
+    post = int(np.prod(shape[axis + 1:]))
+    if post == 1:
+        res = np.matmul(M.reshape(R, pre, n), A.T.reshape(R, n, 1),
+                        out=_view(out, (R, pre, 1)))
+    else:
+        res = np.matmul(A.T.reshape(R, 1, 1, n), M.reshape(R, pre, n, post),
+                        out=_view(out, (R, pre, 1, post)))
+    return res.reshape((R,) + shape[:axis] + shape[axis + 1:])
+
+
+def _view(out, shape):
+    if out is None:
+        return None
+    return out.reshape(shape)
+
+
+def slab_mttkrp(tenpy, S, A, others, axis, start, stop):
+    """MTTKRP contribution of the slab S = T[..., start:stop, ...] along axis.
+
+    Args:
+        S (tensor): slab of T, without a rank axis.
+        A (list): factor matrices of T.
+        others (list): every mode but the one of the MTTKRP, in the order they
+            are contracted.
+        axis (int): mode the slab is taken along.
+        start, stop (int): indices of axis in the slab.
+
+    Returns:
+        (matrix) the rank-first contribution, which covers the rows start:stop
+        of the MTTKRP if its mode is axis and sums up to it otherwise.
+
+    """
+    modes = list(range(S.ndim))
+    M = S
+    for j in others:
+        Aj = A[j][start:stop] if j == axis else A[j]
+        M = contract_rank_first(tenpy, M, modes.index(j), Aj, M is not S)
+        modes.remove(j)
+    return M
+
+
+class SlabContraction():
+    """Contractions of a tensor that does not fit in memory, e.g. a np.memmap,
+    streamed in slabs along its largest mode.
+
+    Only two slabs are resident at a time: the one being contracted and the
+    next one, which a background thread reads from disk meanwhile. A
+    contraction that keeps the slab mode writes every slab result into its part
+    of the output, and one that contracts the slab mode accumulates them.
+
+    Attributes:
+        axis (int): mode the slabs are taken along.
+        size (int): number of indices of axis in a slab.
+        num_slabs (int): number of slabs per pass over the tensor.
+        num_passes (int): number of passes over the tensor so far.
+
+    """
+    def __init__(self, tenpy, T, budget):
+        self.tenpy = tenpy
+        self.T = T
+        self.axis = int(np.argmax(T.shape))
+        # the slab in use and the one being prefetched share the budget
+        self.size = slab_size(T.shape, self.axis, T.dtype.itemsize, budget // 2)
+        self.num_slabs = -(-T.shape[self.axis] // self.size)
+        self.num_passes = 0
+        self._pool = ThreadPoolExecutor(max_workers=1)
+
+    def _slabs(self):
+        views = list(slabs(self.T, self.axis, self.size))
+        self.num_passes += 1
+        load = self._pool.submit(np.array, views[0][2])
+        for k, (start, stop, _) in enumerate(views):
+            S = load.result()
+            if k + 1 < len(views):
+                load = self._pool.submit(np.array, views[k + 1][2])
+            yield start, stop, S
+
+    def close(self):
+        """Shut down the prefetch thread.
+        """
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def stream(self):
+        """Iterate over one pass of the tensor as (start, stop, slab), reading
+        the next slab in the background.
+        """
+        return self._slabs()
+
+    def contract(self, axis, A, out=None):
+        """contract_rank_first of the streamed tensor along axis with A.
+        """
+        R = A.shape[1]
+        rest = self.T.shape[:axis] + self.T.shape[axis + 1:]
+        if out is None:
+            out = np.empty((R,) + rest, dtype=np.result_type(self.T.dtype, A.dtype))
+        if axis == self.axis:
+            out[...] = 0
+            for start, stop, S in self._slabs():
+                out += contract_rank_first(self.tenpy, S, axis, A[start:stop], False)
+            return out
+        # position of the slab mode among the output axes, after the rank axis
+        pos = 1 + self.axis - (self.axis > axis)
+        index = [slice(None)] * out.ndim
+        for start, stop, S in self._slabs():
+            index[pos] = slice(start, stop)
+            out[tuple(index)] = contract_rank_first(self.tenpy, S, axis, A, False)
+        return out
+
+    def mttkrp(self, A, i):
+        """MTTKRP of the streamed tensor with respect to mode i.
+        """
+        R = A[i].shape[1]
+        out = np.zeros((self.T.shape[i], R), dtype=np.result_type(self.T.dtype, A[i].dtype))
+        others = sorted([j for j in range(self.T.ndim) if j != i],
+                        key=lambda j: self.T.shape[j], reverse=True)
+        for start, stop, S in self._slabs():
+            M = slab_mttkrp(self.tenpy, S, A, others, self.axis, start, stop)
+            if i == self.axis:
+                out[start:stop] = M.T
+            else:
+                out += M.T
+        return out
+
+
+def get_slab_contraction(tenpy, T, budget):
+    """SlabContraction of T if T is a dense numpy tensor larger than budget MB,
+    None otherwise or if budget is 0.
+    """
+    if not budget or tenpy.name() != 'numpy' or tenpy.is_sparse(T):
+        return None
+    if T.nbytes <= budget * 2**20:
+        return None
+    engine = SlabContraction(tenpy, T, int(budget * 2**20))
+    tenpy.printf("Streaming the input tensor in", engine.num_slabs, "slabs of", engine.size,
+                 "along mode", engine.axis)
+    return engine
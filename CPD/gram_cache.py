@@ -0,0 +1,95 @@
+class GramCache():
+    """Per-mode Gram matrices of CP factor matrices.
+
+    Holds G[j] = A[j]^T A[j] for every mode and recomputes a Gram only when its
+    factor changes. The Hadamard product of all Grams but one, which forms the
+    left hand side of the ALS normal equations, is assembled from prefix and
+    suffix products, so a sweep costs N Gram updates and O(N) Hadamard products
+    of R x R matrices instead of N(N-1) Gram computations. The same products
+    give the pairwise blocks of the CP Gauss-Newton matrix.
+
+    Attributes:
+        G (list): Gram matrix of every mode.
+        order (int): number of modes.
+
+    """
+    def __init__(self, tenpy, A):
+        self.tenpy = tenpy
+        self.order = len(A)
+        R = A[0].shape[1]
+        self.G = [None] * self.order
+        # factor each Gram was computed from, used to detect replaced factors
+        self._src = [None] * self.order
+        # prefix[k] = G[0]*...*G[k-1] is valid for k <= _prefix_valid,
+        # suffix[k] = G[k]*...*G[N-1] is valid for k >= _suffix_valid
+        self._prefix = [None] * (self.order + 1)
+        self._suffix = [None] * (self.order + 1)
+        self._prefix[0] = tenpy.ones((R, R))
+        self._suffix[self.order] = tenpy.ones((R, R))
+        self._prefix_valid = 0
+        self._suffix_valid = self.order
+        self.refresh(A)
+
+    def update(self, i, Ai):
+        """Recompute the Gram of mode i from its new factor Ai.
+        """
+        self.G[i] = self.tenpy.dot(self.tenpy.transpose(Ai), Ai)
+        self._src[i] = Ai
+        self._prefix_valid = min(self._prefix_valid, i)
+        self._suffix_valid = max(self._suffix_valid, i + 1)
+
+    def refresh(self, A):
+        """Update the Grams of all factors in A that were replaced since they were
+        last seen. Factors modified in place must be passed to update explicitly.
+        """
+        for j in range(self.order):
+            if A[j] is not self._src[j]:
+                self.update(j, A[j])
+
+    def _prefix_product(self, k):
+        while self._prefix_valid < k:
+            p = self._prefix_valid
+            self._prefix[p + 1] = self._prefix[p] * self.G[p]
+            self._prefix_valid += 1
+        return self._prefix[k]
+
+    def _suffix_product(self, k):
+        while self._suffix_valid > k:
+            q = self._suffix_valid
+            self._suffix[q - 1] = self.G[q - 1] * self._suffix[q]
+            self._suffix_valid -= 1
+        return self._suffix[k]
+
+    def hadamard_except(self, i):
+        """Hadamard product of the Grams of every mode but i.
+        """
+        return self._prefix_product(i) * self._suffix_product(i + 1)
+
+    def hadamard_except_pairs(self):
+        """gamma[i][j], the Hadamard product of the Grams of every mode but i and
+        j, for all pairs. Each symmetric pair is formed once and shared, at two
+        Hadamard products per block on top of the prefix and suffix products.
+        """
+        N = self.order
+        gamma = [[None] * N for _ in range(N)]
+        for i in range(N):
+            M = self._prefix_product(i)
+            gamma[i][i] = M * self._suffix_product(i + 1)
+            for j in range(i + 1, N):
+                gamma[i][j] = M * self._suffix_product(j + 1)
+                gamma[j][i] = gamma[i][j]
+                if j + 1 < N:
+                    M = M * self.G[j]
+        return gamma
+
+    def hadamard_all(self):
+        """Hadamard product of the Grams of every mode.
+        """
+        return self._prefix_product(self.order)
+
+    def lin_sys(self, i, Regu):
+        """Left hand side of the regularized normal equations of mode i.
+        """
+        S = self.hadamard_except(i)
+        S += Regu * self.tenpy.eye(S.shape[0])
+        return S
@@ -0,0 +1,151 @@
+import numpy as np
+
+
+def hessian_contract_batch(tenpy, XX, AA, GG, GD, regu=1, diag=False):
+    """Damped Gauss-Newton matrix times a stacked vector, see CP_HessianEngine.
+
+    Args:
+        XX (tensor): N x s x R stack of the vector blocks, zero padded below
+            the size of every mode.
+        AA (tensor): N x s x R stack of the factor matrices, zero padded the
+            same way.
+        GG (tensor): N x N x R x R off-diagonal gamma blocks, zero on the
+            diagonal.
+        GD (tensor): N x R x R diagonal gamma blocks.
+        regu (float): damping.
+        diag (bool): scale the damping of every block by the diagonal of its
+            gamma block.
+
+    Returns:
+        (tensor) the N x s x R stacked product, zero in the padding.
+
+    """
+    W = tenpy.einsum("piz,pir->pzr", XX, AA)
+    S = tenpy.einsum("npzr,pzr->nzr", GG, W)
+    RR = tenpy.einsum("niz,nzr->nir", XX, GD)
+    RR += tenpy.einsum("niz,nzr->nir", AA, S)
+    if diag:
+        RR += regu * tenpy.einsum("nrr,nir->nir", GD, XX)
+    else:
+        RR += regu * XX
+    return RR
+
+
+class CP_HessianEngine():
+    """Products of the damped Gauss-Newton approximation of the CP Hessian with
+    a vector, stored as one matrix per mode like the factors.
+
+    Block (n,p) of J^T J maps X_p to X_n gamma[n][n] for n == p and to
+    A_n (gamma[n][p] * X_p^T A_p) otherwise, where * is the Hadamard product.
+    Every matvec forms W_p = X_p^T A_p once per mode and combines them as
+    X_n gamma[n][n] + A_n sum_{p != n} gamma[n][p] * W_p, which costs
+    O(N s R^2 + N^2 R^2) instead of a contraction per block. Modes may differ
+    in size. With the numpy backend the N^2 Hadamard products are batched
+    over a stack of the gamma blocks, and stacked vectors, as used by
+    fast_conjugate_gradient_batch, are zero padded to the largest mode.
+
+    Attributes:
+        A (list): factor matrices.
+        gamma (list): gamma[n][p], the Hadamard product of the Grams of every
+            mode but n and p.
+        diag (bool): scale the damping of every block by the diagonal of its
+            gamma block instead of the identity.
+        size (int): largest mode size, the padded size of stacked vectors.
+        GG (tensor): N x N x R x R stack of the off-diagonal gamma blocks, zero
+            on the diagonal, numpy only.
+        GD (tensor): N x R x R stack of the diagonal gamma blocks, numpy only.
+        AA (tensor): zero padded stack of the factors, formed on the first
+            stacked matvec.
+
+    """
+    def __init__(self, tenpy, A, gamma, diag=False):
+        self.tenpy = tenpy
+        self.A = A
+        self.gamma = gamma
+        self.diag = diag
+        self.order = len(A)
+        self.size = max(Ai.shape[0] for Ai in A)
+        self.R = A[0].shape[1]
+        self.GG = None
+        self.GD = None
+        self.AA = None
+        self._work = None
+        if tenpy.name() == 'numpy':
+            self._stack_gamma()
+
+    def _stack_gamma(self):
+        N, R = self.order, self.R
+        self.GG = np.zeros((N, N, R, R))
+        self.GD = np.zeros((N, R, R))
+        for n in range(N):
+            for p in range(N):
+                if n != p:
+                    self.GG[n, p] = self.gamma[n][p]
+            self.GD[n] = self.gamma[n][n]
+
+    def stack(self, X):
+        """N x size x R zero padded stack of the matrices X.
+        """
+        XX = self.tenpy.zeros((self.order, self.size, self.R))
+        for n in range(self.order):
+            XX[n, :X[n].shape[0], :] = X[n]
+        return XX
+
+    def unstack(self, XX):
+        """Views of the blocks of a stacked vector, without the padding.
+        """
+        return [XX[n, :self.A[n].shape[0], :] for n in range(self.order)]
+
+    def _damping(self, n, X, regu):
+        if not self.diag:
+            return regu * X
+        if self.tenpy.name() == 'numpy':
+            return X * (regu * np.diagonal(self.gamma[n][n]))
+        return regu * self.tenpy.einsum('jj,ij->ij', self.gamma[n][n], X)
+
+    def matvec(self, X, regu, out=None):
+        """Product with the list of matrices X, one per mode, written to the
+        matrices out when given, numpy only.
+        """
+        tenpy = self.tenpy
+        W = [tenpy.dot(tenpy.transpose(X[p]), self.A[p]) for p in range(self.order)]
+        if self.GG is not None:
+            S = np.einsum("npzr,pzr->nzr", self.GG, np.stack(W))
+        else:
+            S = []
+            for n in range(self.order):
+                S.append(tenpy.zeros((self.R, self.R)))
+                for p in range(self.order):
+                    if p != n:
+                        S[n] += self.gamma[n][p] * W[p]
+        if out is not None:
+            self._matvec_into(X, S, regu, out)
+            return out
+        ret = []
+        for n in range(self.order):
+            Y = tenpy.dot(X[n], self.gamma[n][n])
+            Y += tenpy.dot(self.A[n], S[n])
+            Y += self._damping(n, X[n], regu)
+            ret.append(Y)
+        return ret
+
+    def _matvec_into(self, X, S, regu, out):
+        if self._work is None:
+            self._work = [np.empty_like(Y) for Y in out]
+        for n in range(self.order):
+            Y, work = out[n], self._work[n]
+            np.dot(X[n], self.gamma[n][n], out=Y)
+            np.dot(self.A[n], S[n], out=work)
+            Y += work
+            if self.diag:
+                np.multiply(X[n], regu * np.diagonal(self.gamma[n][n]), out=work)
+            else:
+                np.multiply(X[n], regu, out=work)
+            Y += work
+
+    def matvec_batch(self, XX, regu):
+        """Product with the N x size x R stacked vector XX, numpy only.
+        """
+        if self.AA is None:
+            self.AA = self.stack(self.A)
+        return hessian_contract_batch(self.tenpy, XX, self.AA, self.GG, self.GD, regu, self.diag)
@@ -0,0 +1,94 @@
+import numpy as np
+from .contraction import contract_rank_first
+
+
+def _poly_mul(p, q):
+    """Product of two polynomials with tensor coefficients, lowest degree
+    first, multiplying coefficients elementwise.
+    """
+    ret = [None] * (len(p) + len(q) - 1)
+    for i, a in enumerate(p):
+        for j, b in enumerate(q):
+            ret[i + j] = a * b if ret[i + j] is None else ret[i + j] + a * b
+    return ret
+
+
+def cp_line_polynomial(tenpy, T, A, D, normTsq=None, slabs=None):
+    """Coefficients of the squared residual of a CP decomposition along a
+    search direction.
+
+    f(alpha) = ||T - [[A + alpha D]]||^2 is a polynomial of degree 2N in alpha.
+    Its inner product part <T, [[A + alpha D]]> is contracted mode by mode from
+    the last one, keeping one rank-first intermediate per power of alpha, so
+    the cost is dominated by the two contractions of T with A and D of the
+    last mode. The norm part is the Hadamard product over the modes of the
+    quadratic Gram polynomials (A_n + alpha D_n)^T (A_n + alpha D_n).
+
+    Args:
+        T (tensor): dense input tensor.
+        A (list): factor matrices.
+        D (list): search direction, one matrix per mode.
+        normTsq (float): squared norm of T, computed here if None.
+        slabs (SlabContraction): streams T when it is larger than memory.
+
+    Returns:
+        (array) the 2N+1 coefficients of f, lowest degree first.
+
+    """
+    N = len(A)
+    last = N - 1
+    if slabs is not None:
+        terms = [slabs.contract(last, A[last]), slabs.contract(last, D[last])]
+    else:
+        terms = [contract_rank_first(tenpy, T, last, A[last], False),
+                 contract_rank_first(tenpy, T, last, D[last], False)]
+    for i in range(last - 1, -1, -1):
+        contracted = [None] * (len(terms) + 1)
+        for k, M in enumerate(terms):
+            for j, B in ((k, A[i]), (k + 1, D[i])):
+                C = contract_rank_first(tenpy, M, i, B, True)
+                contracted[j] = C if contracted[j] is None else contracted[j] + C
+        terms = contracted
+
+    norm = [tenpy.ones((A[0].shape[1], A[0].shape[1]))]
+    for i in range(N):
+        AD = tenpy.dot(tenpy.transpose(A[i]), D[i])
+        gram = [tenpy.dot(tenpy.transpose(A[i]), A[i]),
+                AD + tenpy.transpose(AD),
+                tenpy.dot(tenpy.transpose(D[i]), D[i])]
+        norm = _poly_mul(norm, gram)
+
+    if normTsq is None:
+        normTsq = tenpy.vecnorm(T)**2
+    coeffs = np.array([float(tenpy.sum(G)) for G in norm])
+    coeffs[:N + 1] -= 2 * np.array([float(tenpy.sum(M)) for M in terms])
+    coeffs[0] += normTsq
+    return coeffs
+
+
+def exact_line_search(tenpy, T, A, D, normTsq=None, slabs=None):
+    """Step length minimizing ||T - [[A + alpha D]]|| exactly.
+
+    The real critical points of cp_line_polynomial are compared, so the
+    returned alpha is the global minimizer along D and may be negative.
+
+    Args:
+        T (tensor): dense input tensor.
+        A (list): factor matrices.
+        D (list): search direction, one matrix per mode.
+        normTsq (float): squared norm of T, computed here if None.
+        slabs (SlabContraction): streams T when it is larger than memory.
+
+    Returns:
+        alpha (float): the step length.
+        res (float): the residual norm at A + alpha D.
+        res0 (float): the residual norm at A.
+
+    """
+    f = np.polynomial.Polynomial(cp_line_polynomial(tenpy, T, A, D, normTsq, slabs))
+    candidates = [0.]
+    for root in f.deriv().roots():
+        if abs(root.imag) <= 1e-8 * max(1., abs(root.real)):
+            candidates.append(root.real)
+    alpha = min(candidates, key=f)
+    return alpha, max(f(alpha), 0)**.5, max(f(0.), 0)**.5
@@ -0,0 +1,125 @@
+import time
+import numpy as np
+from tensors.utils import slab_size, slabs
+from .common_kernels import compute_mttkrp, get_residual, get_residual_sp, get_residual_gram
+from .contraction import get_slab_contraction
+
+
+class CP_ResidualEngine():
+    """Residual of a CP decomposition that never reconstructs the full tensor.
+
+    The residual is evaluated through the Gram identity
+    ||T - [[A]]||^2 = ||T||^2 - 2<M_i, A_i> + sum(A_0^T A_0 * ... * A_{N-1}^T A_{N-1}),
+    where M_i is the MTTKRP of T with respect to mode i. Optimizers expose the
+    MTTKRP of their last mode update as ``mttkrp = (i, M_i)``, which makes the
+    residual cost O(N s R^2). Without one, a single MTTKRP is contracted here.
+
+    Attributes:
+        normT (float): Frobenius norm of T.
+        ref_freq (int): every ref_freq-th evaluation is checked against the
+            explicit residual, which is then returned. 0 disables the check.
+        cancel_tol (float): the identity subtracts terms of size ||T||^2, so it
+            carries a roundoff of a few eps*||T||^2 for eps the machine
+            epsilon. When the squared residual falls below
+            cancel_tol*eps*||T||^2 it has no correct digits left and the
+            explicit residual is returned instead. Dense tensors reconstruct
+            [[A]] one slab at a time for it, streamed like the MTTKRP when T
+            is larger than memory_budget. 0 never falls back.
+        num_calls (int): number of residual evaluations so far.
+        slabs (SlabContraction): streams T for the MTTKRP contracted here when
+            T is larger than memory_budget MB, or the one of an optimizer if
+            given.
+
+    """
+    # largest slab of [[A]] reconstructed at once for an in-memory T
+    slab_bytes = 2**26
+
+    def __init__(self, tenpy, T, O=None, sp=False, ref_freq=0, cancel_tol=100,
+                 memory_budget=0, slabs=None):
+        self.tenpy = tenpy
+        self.T = T
+        self.O = O
+        self.sp = sp
+        self.ref_freq = ref_freq
+        self.cancel_tol = cancel_tol
+        self.eps = np.finfo(np.float64).eps
+        self.normT = tenpy.vecnorm(T)
+        self.normTsq = self.normT**2
+        self.num_calls = 0
+        self.slabs = slabs
+        if slabs is None and not sp:
+            self.slabs = get_slab_contraction(tenpy, T, memory_budget)
+
+    def _mttkrp(self, A):
+        i = len(A) - 1
+        if self.sp:
+            lst = A[:]
+            lst[i] = self.tenpy.zeros(A[i].shape)
+            self.tenpy.MTTKRP(self.T, lst, i)
+            return i, lst[i]
+        if self.slabs is not None:
+            return i, self.slabs.mttkrp(A, i)
+        return i, compute_mttkrp(self.tenpy, self.T, A, i)
+
+    def reference_residual(self, A):
+        if self.sp and self.O is not None:
+            return get_residual_sp(self.tenpy, self.O, self.T, A)
+        return get_residual(self.tenpy, self.T, A)
+
+    def close(self):
+        if self.slabs is not None:
+            self.slabs.close()
+
+    def explicit_residual(self, A):
+        """||T - [[A]]|| from a reconstruction of one slab of T at a time.
+        """
+        if self.sp or self.tenpy.name() != 'numpy':
+            return self.reference_residual(A)
+        if self.slabs is not None:
+            axis, parts = self.slabs.axis, self.slabs.stream()
+        else:
+            axis = int(np.argmax(self.T.shape))
+            size = slab_size(self.T.shape, axis, self.T.dtype.itemsize, self.slab_bytes)
+            parts = slabs(self.T, axis, size)
+        letters = [chr(ord('a') + j) for j in range(self.T.ndim)]
+        einstr = ",".join(l + 'z' for l in letters) + "->" + "".join(letters)
+        nrmsq = 0.
+        for start, stop, S in parts:
+            B = list(A)
+            B[axis] = A[axis][start:stop]
+            nrmsq += self.tenpy.vecnorm(S - self.tenpy.einsum(einstr, *B))**2
+        return nrmsq**.5
+
+    def get_residual(self, A, mttkrp=None, gram=None):
+        """Residual norm of the decomposition A.
+
+        Args:
+            A (list): factor matrices.
+            mttkrp (tuple): (i, M_i) with M_i the MTTKRP of mode i at the current A,
+                or None to contract one here.
+            gram (GramCache): optional Gram cache of the optimizer producing A.
+
+        Returns:
+            (float) ||T - [[A]]||
+
+        """
+        self.num_calls += 1
+        if mttkrp is None:
+            mttkrp = self._mttkrp(A)
+        i, M = mttkrp
+        H = None
+        if gram is not None:
+            gram.refresh(A)
+            H = gram.hadamard_all()
+        nrmsq = get_residual_gram(self.tenpy, self.normTsq, A, M, i, H)
+
+        check = self.ref_freq > 0 and self.num_calls % self.ref_freq == 0
+        if nrmsq < self.cancel_tol * self.eps * self.normTsq or check:
+            t0 = time.time()
+            res = self.explicit_residual(A)
+            t1 = time.time()
+            if check:
+                self.tenpy.printf("Reference residual is", res, "Gram residual is",
+                                  max(nrmsq, 0)**.5, "reference took", t1 - t0, "seconds")
+            return res
+        return nrmsq**.5
@@ -1,31 +1,129 @@
 import numpy as np
-from .common_kernels import solve_sys, compute_lin_sysN
+import os
+from concurrent.futures import ThreadPoolExecutor
+from .common_kernels import solve_sys
+from .gram_cache import GramCache
+from .contraction import contract_rank_first, rank_first_einstr, get_slab_contraction, slab_mttkrp
+from .line_search import exact_line_search
 from als.ALS_optimizer import DTALS_base, PPALS_base
+from als.dimension_tree import leaves
+from als.sweep_plan import SweepPlan
+from tensors.utils import slabs
 
 
 class CP_DTALS_Optimizer(DTALS_base):
+    def __init__(self, tenpy, T, A, args):
+        DTALS_base.__init__(self, tenpy, T, A, args)
+        # (mode, MTTKRP) of the last exact mode update, used by CP_ResidualEngine
+        self.mttkrp = None
+        self.gram = GramCache(tenpy, A)
+        # root contractions of a tensor larger than the memory budget are streamed
+        self.slabs = None
+        if not self.sp:
+            self.slabs = get_slab_contraction(tenpy, T, getattr(args, 'memory_budget', 0))
+        # every line_extrapolate sweeps A moves along the change of the last sweep
+        self.line_extrapolate = 0 if self.sp else getattr(args, 'line_extrapolate', 0)
+        self.num_sweeps = 0
+        self.normTsq = None
+        if getattr(args, 'layout', 0) and tenpy.name() == 'numpy' and not self.sp \
+                and self.slabs is None:
+            self._set_layout()
+
+    def _set_layout(self):
+        """Store a copy of T with the two modes contracted first at the root on
+        its outermost axes, so that both root contractions map to plain matrix
+        products. Contractions are labelled by mode, so the factor matrices keep
+        the original mode order and need no mapping back.
+        """
+        if not isinstance(self.dim_tree, tuple):
+            return
+        left, right = self.dim_tree
+        last = self._contraction_order(leaves(right))[0]
+        first = self._contraction_order(leaves(left))[0]
+        modes = [first] + [j for j in range(self.order) if j not in (first, last)] + [last]
+        if modes == self.root_modes:
+            return
+        self.root_modes = modes
+        self.T_root = np.ascontiguousarray(np.transpose(self.T, modes))
+        self.tenpy.printf("Root tensor layout", modes)
+
     def _einstr_builder(self, M, s, ii):
-        ci = ""
-        nd = M.ndim
-        if len(s) != 1:
-            ci = "R"
-            nd = M.ndim - 1
-
-        str1 = "".join([chr(ord('a') + j) for j in range(nd)]) + ci
-        str2 = (chr(ord('a') + ii)) + "R"
-        str3 = "".join([chr(ord('a') + j) for j in range(nd) if j != ii]) + "R"
-        einstr = str1 + "," + str2 + "->" + str3
-        return einstr
+        modes = s[-1][0]
+        return rank_first_einstr(modes, ii, M.ndim != len(modes))
+
+    def _contract(self, s, ii, out=None):
+        # intermediates carry the rank axis first, see contract_rank_first
+        modes, M = s[-1]
+        if M is self.T_root and self.slabs is not None:
+            return self.slabs.contract(modes.index(ii), self.A[ii], out)
+        return contract_rank_first(self.tenpy, M, modes.index(ii), self.A[ii],
+                                   M.ndim != len(modes), out)
+
+    def _node_shape(self, modes):
+        return (self.R,) + tuple(self.T.shape[j] for j in modes)
+
+    def _workspace_alloc(self):
+        if self.tenpy.name() != 'numpy':
+            return None
+        dtype = np.result_type(self.T_root.dtype, self.A[0].dtype)
+        return lambda shape: np.empty(shape, dtype=dtype)
+
+    def _edge_cost(self, parent, child):
+        flops = 0
+        remaining = list(parent)
+        for ii in self._contraction_order([j for j in parent if j not in child]):
+            flops += np.prod([self.T.shape[j] for j in remaining]) * self.R
+            remaining.remove(ii)
+        return flops
+
+    def _solve_gram(self, i, Regu, M):
+        self.gram.refresh(self.A)
+        X = solve_sys(self.tenpy, self.gram.lin_sys(i, Regu), M)
+        self.gram.update(i, X)
+        return X
 
     def _solve(self, i, Regu, s):
-        return solve_sys(self.tenpy,
-                         compute_lin_sysN(self.tenpy, self.A, i, Regu),
-                         s[-1][1])
+        M = self.tenpy.transpose(s[-1][1])
+        self.mttkrp = (i, M)
+        return self._solve_gram(i, Regu, M)
 
     def _sp_solve(self,i,Regu,g):
-        return solve_sys(self.tenpy,
-                         compute_lin_sysN(self.tenpy, self.A, i, Regu),
-                         g)
+        self.mttkrp = (i, g)
+        return self._solve_gram(i, Regu, g)
+
+    def close(self):
+        if self.slabs is not None:
+            self.slabs.close()
+
+    def step(self, Regu):
+        prev = list(self.A)
+        A = self._sweep(Regu)
+        self.num_sweeps += 1
+        if self.line_extrapolate and self.num_sweeps % self.line_extrapolate == 0:
+            self._extrapolate(prev)
+        return A
+
+    def _sweep(self, Regu):
+        # one update of every mode, overridden by the other sweep schemes so
+        # that step extrapolates them all
+        return DTALS_base.step(self, Regu)
+
+    def _extrapolate(self, prev):
+        """Move A along the change D = A - prev of the last sweep to the
+        minimizer of the residual, found by an exact polynomial line search.
+        Sweeps replace the factors, so prev holds the factors before it.
+        """
+        if self.normTsq is None:
+            self.normTsq = self.tenpy.vecnorm(self.T)**2
+        D = [self.A[i] - prev[i] for i in range(self.order)]
+        alpha, res, res0 = exact_line_search(self.tenpy, self.T, self.A, D,
+                                             self.normTsq, self.slabs)
+        if alpha == 0 or res >= res0:
+            return
+        for i in range(self.order):
+            self.A[i] = self.A[i] + alpha * D[i]
+        # the MTTKRP of the last update no longer matches A
+        self.mttkrp = None
 
 
 
@@ -34,8 +132,15 @@ class CP_PPALS_Optimizer(PPALS_base, CP_DTALS_Optimizer):
 
     """
     def __init__(self, tenpy, T, A, args):
+        if args.sp:
+            # the PP tree holds dense contractions of T with all but two factors
+            raise ValueError('Pairwise perturbation does not support sparse tensors')
         PPALS_base.__init__(self, tenpy, T, A, args)
         CP_DTALS_Optimizer.__init__(self, tenpy, T, A,args)
+        # dA tracks the factors against the PP tree, so DT sweeps are not extrapolated
+        self.line_extrapolate = 0
+        # workspace of the fused PP step by mode
+        self.pp_buffers = {}
 
     def _get_einstr(self, nodeindex, parent_nodeindex, contract_index):
         """Build the Einstein string for the contraction.
@@ -53,22 +158,423 @@ class CP_PPALS_Optimizer(PPALS_base, CP_DTALS_Optimizer):
 
         Example:
             When the input tensor has 4 dimensions:
-            _get_einstr(np.array([1,2]), np.array([1,2,3]), 3) == "abcR,cR->abR"
+            _get_einstr(np.array([1,2]), np.array([1,2,3]), 3) == "Rbcd,dR->Rbc"
 
         """
-        ci = ""
-        if len(parent_nodeindex) != self.order:
-            ci = "R"
+        return rank_first_einstr(list(parent_nodeindex), contract_index,
+                                 len(parent_nodeindex) != self.order)
+
+    def _contract_node(self, nodeindex, parent_nodeindex, contract_index, M, X):
+        if M is self.T and self.slabs is not None:
+            return self.slabs.contract(list(parent_nodeindex).index(contract_index), X)
+        return contract_rank_first(self.tenpy, M, list(parent_nodeindex).index(contract_index),
+                                   X, len(parent_nodeindex) != self.order)
+
+    def _stack_name(self, i):
+        return self._get_nodename(np.array([i])) + '*'
+
+    def _stack_offset(self, i, j):
+        # column of mode j in the stacked operator of mode i
+        return sum(self.A[k].shape[0] for k in range(j) if k != i)
 
-        str1 = "".join([chr(ord('a') + j) for j in parent_nodeindex]) + ci
-        str2 = (chr(ord('a') + contract_index)) + "R"
-        str3 = "".join([chr(ord('a') + j) for j in nodeindex]) + "R"
-        einstr = str1 + "," + str2 + "->" + str3
-        return einstr
+    def _pp_stack_shapes(self):
+        # mode i reads the pairs (i,j) of all j as one (R, s_i, sum_{j!=i} s_j)
+        # operator, which holds every pair twice
+        if self.tenpy.name() != 'numpy':
+            return {}
+        R = self.A[0].shape[1]
+        S = sum(A.shape[0] for A in self.A)
+        return dict((self._stack_name(i), (R, self.A[i].shape[0], S - self.A[i].shape[0]))
+                    for i in self.pp_modes)
+
+    def _stack_pp_node(self, nodeindex, N):
+        if len(nodeindex) != 2:
+            return
+        i, j = nodeindex
+        si, sj = self.A[i].shape[0], self.A[j].shape[0]
+        if self._stack_name(i) in self.tree:
+            off = self._stack_offset(i, j)
+            self.tree[self._stack_name(i)][1][:, :, off:off + sj] = N
+        if self._stack_name(j) in self.tree:
+            off = self._stack_offset(j, i)
+            self.tree[self._stack_name(j)][1][:, :, off:off + si] = N.transpose(0, 2, 1)
+
+    def _pp_mttkrp(self, i):
+        if self.tenpy.name() != 'numpy':
+            return PPALS_base._pp_mttkrp(self, i)
+        stack = self.tree[self._stack_name(i)][1]
+        R, si, S = stack.shape
+        if self.pp_buffers.get(i) is None or self.pp_buffers[i][0].dtype != stack.dtype:
+            self.pp_buffers[i] = (np.empty((R, S), dtype=stack.dtype),
+                                  np.empty((R, si, 1), dtype=stack.dtype))
+        D, N = self.pp_buffers[i]
+        np.concatenate([self.dA[j].T for j in range(self.order) if j != i], axis=1, out=D)
+        np.matmul(stack, D.reshape(R, S, 1), out=N)
+        N = N.reshape(R, si)
+        N += self.tree[self._get_nodename(np.array([i]))][1]
+        return N
 
     def _step_dt(self, Regu):
         return CP_DTALS_Optimizer.step(self, Regu)
 
     def _solve_PP(self, i, Regu, N):
-        return solve_sys(self.tenpy,
-                         compute_lin_sysN(self.tenpy, self.A, i, Regu), N)
+        # N is only a pairwise perturbation approximation of the MTTKRP
+        self.mttkrp = None
+        return self._solve_gram(i, Regu, self.tenpy.transpose(N))
+
+
+class CP_partialPPALS_Optimizer(CP_PPALS_Optimizer):
+    """Partial pairwise perturbation CP decomposition optimizer
+
+    After a DT sweep, only the modes whose factors changed by less than
+    tol_restart_dt relative to their norm are perturbed. The PP tree holds the
+    operators those modes read, so the pairs and single mode nodes of the
+    modes that still change fast are never formed. In a PP step, the slow modes
+    are updated by pairwise perturbation first. Then T is contracted with their
+    factors once, and the fast modes are updated exactly from that
+    intermediate.
+
+    The error of a perturbed mode is led by the product of the relative
+    changes of two other modes, fast ones included, so PP is entered while the
+    product of the two largest relative changes is below tol_restart_dt^2. It
+    is left as in CP_PPALS_Optimizer once any mode changed by more than
+    tol_restart_dt since the tree was formed, and also as soon as the fitness
+    reported by record_fitness drops after a PP step. With pp_adaptive, the
+    controller decides as in CP_PPALS_Optimizer and every mode is perturbed.
+
+    """
+    def __init__(self, tenpy, T, A, args):
+        CP_PPALS_Optimizer.__init__(self, tenpy, T, A, args)
+        self._fitness = None
+
+    def record_fitness(self, fitness):
+        # a PP step has been taken since the last fitness if the tree is formed
+        dropped = self.pp and not self.reinitialize_tree and \
+            self._fitness is not None and fitness < self._fitness
+        self._fitness = fitness
+        if self.controller is not None:
+            self.controller.record_fitness(fitness)
+        elif dropped:
+            self.tenpy.printf("Fitness dropped in a PP step, leaving PP")
+            self.pp = False
+            self.triplet_terms = []
+
+    def _enter_pp(self, rel):
+        if self.controller is not None:
+            self._set_pp_modes(range(self.order))
+            return PPALS_base._enter_pp(self, rel)
+        slow = [i for i in range(self.order) if rel[i] < self.tol_restart_dt]
+        top = sorted(rel)[::-1]
+        if len(slow) < 2 or top[0] * top[1] >= self.tol_restart_dt**2:
+            return False
+        self._set_pp_modes(slow)
+        if len(slow) < self.order:
+            self.tenpy.printf("Perturbing modes", slow)
+        return True
+
+    def _step_exact_modes(self, Regu):
+        fast = [j for j in range(self.order) if j not in self.pp_modes]
+        if not fast:
+            return
+        modes = list(range(self.order))
+        M = self.T
+        for j in self._contraction_order(self.pp_modes):
+            new_modes = [k for k in modes if k != j]
+            M = self._contract_node(np.array(new_modes), np.array(modes), j, M, self.A[j])
+            modes = new_modes
+        for i in fast:
+            s = [(modes, M)]
+            for j in self._contraction_order([k for k in fast if k != i]):
+                new_modes = [k for k in s[-1][0] if k != j]
+                s.append((new_modes, self._contract_node(np.array(new_modes), np.array(s[-1][0]), j,
+                                                         s[-1][1], self.A[j])))
+            output = self._solve(i, Regu, s)
+            self.dA[i] += output
+            self.dA[i] -= self.A[i]
+            self.A[i] = output
+
+
+class CP_MSDTALS_Optimizer(CP_DTALS_Optimizer):
+    """Multi-sweep dimension tree CP decomposition optimizer
+
+    Modes are updated in the same cyclic order as CP_DTALS_Optimizer, given by
+    _update_order, so the iterates are the same. Every window of N-1 consecutive updates leaves out
+    the mode updated right before it, and a single first-level contraction of
+    T with that factor serves the whole window, also across sweep boundaries.
+    This costs N first-level contractions per N-1 sweeps instead of 2 per sweep.
+
+    Attributes:
+        update_order (list): cyclic order the modes are updated in.
+        next_mode (int): mode updated next.
+        window_left (int): number of updates left in the current window.
+        window_start (int): first mode updated in the current window.
+        window (list): dimension tree stack of (modes, tensor) of the current window.
+
+    References:
+        Linjian Ma and Edgar Solomonik; Efficient parallel CP decomposition with
+        pairwise perturbation and multi-sweep dimension tree; arXiv:2010.12056, 2020.
+    """
+    def __init__(self, tenpy, T, A, args):
+        CP_DTALS_Optimizer.__init__(self, tenpy, T, A, args)
+        self.order = len(A)
+        self.update_order = self._update_order()
+        self._position = {j: k for k, j in enumerate(self.update_order)}
+        self.next_mode = self.update_order[0]
+        self.window_left = 0
+        self.window_start = 0
+        self.window = []
+        self._factors = list(A)
+
+    def _cyclic_next(self, i, shift=1):
+        return self.update_order[(self._position[i] + shift) % self.order]
+
+    def _start_window(self, i):
+        k = self._cyclic_next(i, -1)
+        s = [(self.root_modes, self.T_root)]
+        self.window = [([j for j in self.root_modes if j != k], self._contract(s, k))]
+        self.window_start = i
+        self.window_left = self.order - 1
+
+    def _window_position(self, j):
+        return (self._position[j] - self._position[self.window_start]) % self.order
+
+    def _sweep(self, Regu):
+        if self.sp:
+            return DTALS_base.step(self, Regu)
+        # intermediates are only valid for the factors they were built from
+        if any(self.A[j] is not self._factors[j] for j in range(self.order)):
+            self.window_left = 0
+            self.next_mode = self.update_order[0]
+        for _ in range(self.order):
+            i = self.next_mode
+            if self.window_left == 0:
+                self._start_window(i)
+            s = self.window
+            while i not in s[-1][0]:
+                s.pop()
+                assert(len(s) >= 1)
+            while len(s[-1][0]) != 1:
+                modes = s[-1][0]
+                # contract the mode updated last within the window
+                ii = max([j for j in modes if j != i], key=self._window_position)
+                s.append(([j for j in modes if j != ii], self._contract(s, ii)))
+            self.A[i] = self._solve(i, Regu, s)
+            self.window_left -= 1
+            self.next_mode = self._cyclic_next(i)
+        self._factors = list(self.A)
+        return self.A
+
+
+class CP_DTLRALS_Optimizer(CP_DTALS_Optimizer):
+    """Low-rank dimension tree CP decomposition optimizer
+
+    The two first-level intermediates of the dimension tree, T contracted with
+    the factors of the modes of the other child of the root, are kept across
+    sweeps. Instead of contracting T with the full factors again, the change of
+    the Khatri-Rao product of those factors since the intermediate was formed is
+    truncated to low rank by an SVD, and only the left singular vectors are
+    contracted with T. With a change of rank k, this costs O(s^N k) instead of
+    O(s^N R) per first-level intermediate. The rest of the tree is swept as
+    usual from the updated intermediates. The truncated part of the change is
+    carried to the next sweep, and every num_inter_iter sweeps both
+    intermediates are recomputed exactly.
+
+    Attributes:
+        lr_tol (float): singular values of the change below lr_tol times the
+            largest one are dropped, if do_lr_tol.
+        do_lr_tol (bool): truncate by lr_tol rather than to rank r.
+        r (int): rank of the truncated change if not do_lr_tol.
+        num_init_iter (int): number of exact sweeps before the first low-rank one.
+        num_inter_iter (int): period in sweeps of the exact recomputations.
+        num_sweeps (int): number of sweeps so far.
+        children (list): the two children of the root of the dimension tree.
+        M (list): first-level intermediate of each child, rank axis first.
+        K (list): Khatri-Rao product of the factors contracted into each
+            intermediate, with an axis per mode followed by the rank axis.
+        ranks (list): rank of the last update of each intermediate, None for
+            an exact recomputation.
+
+    """
+    def __init__(self, tenpy, T, A, args):
+        CP_DTALS_Optimizer.__init__(self, tenpy, T, A, args)
+        self.lr_tol = getattr(args, 'lr_tol', 0.1)
+        self.do_lr_tol = bool(getattr(args, 'do_lr_tol', 1))
+        self.r = getattr(args, 'r', 10)
+        self.num_init_iter = getattr(args, 'num_lowr_init_iter', 2)
+        self.num_inter_iter = max(getattr(args, 'num_inter_iter', 10), 1)
+        self.children = list(self.dim_tree) if isinstance(self.dim_tree, tuple) else []
+        self.M = [None, None]
+        self.K = [None, None]
+        self.ranks = [None, None]
+        self._plans = None
+
+    def _letters(self, modes):
+        return "".join([chr(ord('a') + j) for j in modes])
+
+    def _child_modes(self, c):
+        # modes of the intermediate of child c and of the factors contracted into it
+        kept = leaves(self.children[c])
+        return ([j for j in self.root_modes if j in kept],
+                [j for j in self.root_modes if j not in kept])
+
+    def _khatri_rao(self, modes):
+        if len(modes) == 1:
+            return self.A[modes[0]].copy()
+        einstr = ",".join([self._letters([j]) + "R" for j in modes]) + "->" + self._letters(modes) + "R"
+        return self.tenpy.einsum(einstr, *[self.A[j] for j in modes])
+
+    def _recompute(self, c):
+        kept, other = self._child_modes(c)
+        s = [(self.root_modes, self.T_root)]
+        for ii in self._contraction_order(other):
+            s.append(([j for j in s[-1][0] if j != ii], self._contract(s, ii)))
+        self.M[c] = s[-1][1]
+        self.K[c] = self._khatri_rao(other)
+        self.ranks[c] = None
+
+    def _truncate(self, sv):
+        if self.do_lr_tol:
+            return int(np.sum(sv > self.lr_tol * sv[0])) if sv[0] > 0 else 0
+        return min(self.r, len(sv))
+
+    def _lowrank_update(self, c):
+        kept, other = self._child_modes(c)
+        dK = self._khatri_rao(other) - self.K[c]
+        ostr = self._letters(other)
+        # the right singular vectors of the tall change dK are those of its
+        # R x R Gram matrix, which is much cheaper to decompose
+        V, sv, _ = self.tenpy.svd(self.tenpy.einsum(ostr + "R," + ostr + "S->RS", dK, dK))
+        sv = sv**.5
+        k = self._truncate(sv)
+        self.ranks[c] = k
+        if k == 0:
+            return
+        V = V[:, :k]
+        U = self.tenpy.einsum(ostr + "R,RZ,Z->" + ostr + "Z", dK, V, 1. / sv[:k])
+        VT = self.tenpy.einsum("Z,RZ->ZR", sv[:k], V)
+        if self.tenpy.name() == 'numpy':
+            W = self._contract_vectors(other, U)
+            M = self.M[c].reshape(self.R, -1)
+            M += np.dot(VT.T, W.reshape(k, -1))
+        else:
+            kstr = self._letters(kept)
+            W = self.tenpy.einsum(self._letters(self.root_modes) + "," + ostr + "Z->Z" + kstr,
+                                  self.T_root, U)
+            self.M[c] += self.tenpy.einsum("Z" + kstr + ",ZR->R" + kstr, W, VT)
+        self.K[c] += self.tenpy.einsum(ostr + "Z,ZR->" + ostr + "R", U, VT)
+
+    def _contract_vectors(self, other, U):
+        # T_root contracted over the modes other with the singular vectors U, as
+        # one GEMM on the leading or trailing axes of T_root
+        if self.slabs is not None:
+            return self._stream_vectors(other, U)
+        axes = [self.root_modes.index(j) for j in other]
+        n = len(other)
+        if axes[0] == 0:
+            return np.tensordot(U, self.T_root, axes=(list(range(n)), axes))
+        W = np.tensordot(self.T_root, U, axes=(axes, list(range(n))))
+        return np.moveaxis(W, -1, 0)
+
+    def _stream_vectors(self, other, U):
+        # _contract_vectors one slab of T_root at a time, writing the slab part
+        # of W when the slab mode is kept and accumulating W otherwise
+        axes = [self.root_modes.index(j) for j in other]
+        n = len(other)
+        kept = [j for j in self.root_modes if j not in other]
+        mode = self.root_modes[self.slabs.axis]
+        W = np.zeros((U.shape[-1],) + tuple(self.T_root.shape[self.root_modes.index(j)] for j in kept),
+                     dtype=np.result_type(self.T_root.dtype, U.dtype))
+        index = [slice(None)] * W.ndim
+        for start, stop, S in self.slabs.stream():
+            if mode in other:
+                Uindex = [slice(None)] * U.ndim
+                Uindex[other.index(mode)] = slice(start, stop)
+                W += np.moveaxis(np.tensordot(S, U[tuple(Uindex)], axes=(axes, list(range(n)))), -1, 0)
+            else:
+                index[1 + kept.index(mode)] = slice(start, stop)
+                W[tuple(index)] = np.moveaxis(np.tensordot(S, U, axes=(axes, list(range(n)))), -1, 0)
+        return W
+
+    def _compile_plans(self):
+        dtype = np.result_type(self.T_root.dtype, self.A[0].dtype)
+        plans = []
+        for c in range(2):
+            kept, _ = self._child_modes(c)
+            plans.append(SweepPlan(self.children[c], kept, self._contraction_order, self._node_shape,
+                                   dtype.itemsize, self._workspace_alloc(), edge_cost=self._edge_cost))
+        return plans
+
+    def _sweep(self, Regu):
+        if self.sp or not self.children:
+            return DTALS_base.step(self, Regu)
+        if self._plans is None:
+            self._plans = self._compile_plans()
+        k = self.num_sweeps - self.num_init_iter
+        exact = k < 0 or k % self.num_inter_iter == 0
+        for c in range(2):
+            if exact:
+                self._recompute(c)
+            else:
+                self._lowrank_update(c)
+            self._plans[c].run(self.M[c],
+                               lambda modes, M, ii, out: self._contract([(modes,M)],ii,out),
+                               lambda i, M: self._update_mode(i,Regu,M))
+        if not exact:
+            # the MTTKRP of the last update is only approximate
+            self.mttkrp = None
+            self.tenpy.printf("Low rank updates of the first level intermediates of ranks", self.ranks)
+        return self.A
+
+
+class CP_SlicedALS_Optimizer(CP_DTALS_Optimizer):
+    """Sliced standard ALS CP decomposition optimizer
+
+    T is partitioned into num_slices slices along its largest mode. Every mode
+    update contracts each slice with the factors of the other modes on its own,
+    which bounds the intermediates by the size of a slice, and the slices are
+    contracted concurrently. The contributions are then merged in slice order,
+    by placing them when the slice mode is updated and by summing them
+    otherwise, and the mode is solved for as in CP_DTALS_Optimizer. Sparse
+    tensors and other backends than numpy are swept with the dimension tree.
+
+    Attributes:
+        num_slices (int): number of slices of T.
+        axis (int): mode T is sliced along.
+        slices (list): (start, stop, view) of every slice.
+
+    """
+    def __init__(self, tenpy, T, A, args):
+        CP_DTALS_Optimizer.__init__(self, tenpy, T, A, args)
+        self.num_slices = max(getattr(args, 'num_slices', 1), 1)
+        self.axis = int(np.argmax(T.shape))
+        size = -(-T.shape[self.axis] // self.num_slices)
+        self.slices = []
+        self._pool = None
+        if not self.sp and tenpy.name() == 'numpy':
+            self.slices = list(slabs(T, self.axis, size))
+            self._pool = ThreadPoolExecutor(max_workers=min(len(self.slices), os.cpu_count() or 1))
+
+    def _sliced_mttkrp(self, i):
+        others = self._contraction_order([j for j in range(self.order) if j != i])
+        parts = [self._pool.submit(slab_mttkrp, self.tenpy, S, self.A, others, self.axis, start, stop)
+                 for start, stop, S in self.slices]
+        M = np.zeros((self.R, self.T.shape[i]), dtype=np.result_type(self.T.dtype, self.A[i].dtype))
+        for (start, stop, _), part in zip(self.slices, parts):
+            if i == self.axis:
+                M[:, start:stop] = part.result()
+            else:
+                M += part.result()
+        return M
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        CP_DTALS_Optimizer.close(self)
+
+    def _sweep(self, Regu):
+        if self._pool is None:
+            return DTALS_base.step(self, Regu)
+        for i in self._update_order():
+            self._update_mode(i, Regu, self._sliced_mttkrp(i))
+        return self.A
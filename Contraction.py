@@ -1,4 +1,4 @@
-from CPD.NLS import fast_hessian_contract, CP_fastNLS_Optimizer
+from CPD.NLS import CP_fastNLS_Optimizer
 from CPD.common_kernels import compute_number_of_variables, flatten_Tensor, reshape_into_matrices, solve_sys, get_residual
 from CPD.standard_ALS import CP_DTALS_Optimizer
 import argparse
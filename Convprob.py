@@ -1,7 +1,5 @@
 import numpy as np
 import time
-import CPD.standard_ALS3 as stnd_ALS
-import CPD.common_kernels as ck
 import sys
 import os
 import argparse
@@ -10,9 +8,9 @@ from os.path import dirname, join
 import argparse
 import arg_defs as arg_defs
 import csv
-from CPD.standard_ALS import CP_DTALS_Optimizer
+from CPD.standard_ALS import CP_DTALS_Optimizer, CP_DTLRALS_Optimizer
 from CPD.NLS import CP_fastNLS_Optimizer
-from CPD.common_kernels import get_residual_sp, get_residual
+from CPD.residual import CP_ResidualEngine
 
 parent_dir = dirname(__file__)
 results_dir = join(parent_dir, 'results')
@@ -48,6 +46,7 @@ def convprob(tenpy,tensor,s,f_R,l_R,num_iter,num_gen,method,csv_writer=None,num_
                 c = tenpy.random((s,R))
 
             T = tenpy.einsum('ia,ja,ka->ijk', a,b,c)
+            res_engine = CP_ResidualEngine(tenpy,T,ref_freq=args.res_ref_freq)
             converged = 0
             for j in range(num_init):
                 total_iters = 0
@@ -67,12 +66,13 @@ def convprob(tenpy,tensor,s,f_R,l_R,num_iter,num_gen,method,csv_writer=None,num_
                 Regu = orig_Regu
                 args.maxiter = 4*s*R
                 optimizer_list = {
-                'DT': CP_DTALS_Optimizer(tenpy,T,X,args),
-                'NLS': CP_fastNLS_Optimizer(tenpy,T,X,args)}
+                'DT': CP_DTALS_Optimizer,
+                'DTLR': CP_DTLRALS_Optimizer,
+                'NLS': CP_fastNLS_Optimizer}
                 
-                optimizer = optimizer_list[method]
+                optimizer = optimizer_list[method](tenpy,T,X,args)
 
-                prev_res = ck.get_residual3(tenpy,T,X[0],X[1],X[2])
+                prev_res = res_engine.get_residual(X)
                 #print('Residual is',prev_res)
                 
                 start = time.time()
@@ -84,7 +84,7 @@ def convprob(tenpy,tensor,s,f_R,l_R,num_iter,num_gen,method,csv_writer=None,num_
                         delta = optimizer.step(Regu)
                  
                     
-                    res = ck.get_residual3(tenpy,T,X[0],X[1],X[2])
+                    res = res_engine.get_residual(X,optimizer.mttkrp)
                     
                     
                     
@@ -104,7 +104,7 @@ def convprob(tenpy,tensor,s,f_R,l_R,num_iter,num_gen,method,csv_writer=None,num_
                             elif decrease:
                                 Regu = Regu/varying_fact
                     
-                    if method == 'DT':
+                    if method in ('DT', 'DTLR'):
                         if varying:
                             if i%100 == 0:
                                 lower = lower/2
@@ -141,7 +141,8 @@ def convprob(tenpy,tensor,s,f_R,l_R,num_iter,num_gen,method,csv_writer=None,num_
 
                 end = time.time()
                 
-                res = ck.get_residual3(tenpy,T,X[0],X[1],X[2])
+                res = res_engine.get_residual(X,optimizer.mttkrp)
+                optimizer.close()
                 #print('Residual after convergence is',res)
                 
                 t_all+= end - start
@@ -163,7 +164,9 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
     arg_defs.add_nls_arguments(parser)
+    arg_defs.add_sparse_arguments(parser)
     arg_defs.add_probability_arguments(parser)
+    arg_defs.add_lrdt_arguments(parser)
     args, _ = parser.parse_known_args()
     
     # Set up CSV logging
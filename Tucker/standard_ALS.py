@@ -5,11 +5,11 @@ from als.ALS_optimizer import DTALS_base, PPALS_base
 
 
 class Tucker_DTALS_Optimizer(DTALS_base):
-    def __init__(self, tenpy, T, A):
-        DTALS_base.__init__(self, tenpy, T, A)
+    def __init__(self, tenpy, T, A, args):
         self.tucker_rank = []
         for i in range(len(A)):
             self.tucker_rank.append(A[i].shape[1])
+        DTALS_base.__init__(self, tenpy, T, A, args)
 
     def _einstr_builder(self, M, s, ii):
         nd = M.ndim
@@ -21,6 +21,22 @@ class Tucker_DTALS_Optimizer(DTALS_base):
         einstr = str1 + "," + str2 + "->" + str3
         return einstr
 
+    def _edge_cost(self, parent, child):
+        # contracted modes keep their position with the Tucker rank as size
+        dims = [
+            self.T.shape[j] if j in parent else self.tucker_rank[j]
+            for j in range(len(self.tucker_rank))
+        ]
+        flops = 0
+        for ii in self._contraction_order([j for j in parent if j not in child]):
+            flops += np.prod(dims) * self.tucker_rank[ii]
+            dims[ii] = self.tucker_rank[ii]
+        return flops
+
+    def _node_shape(self, modes):
+        return tuple(self.T.shape[j] if j in modes else self.tucker_rank[j]
+                     for j in range(len(self.tucker_rank)))
+
     def _solve(self, i, Regu, s):
         # NOTE: Regu is not used here
         return n_mode_eigendec(self.tenpy,
@@ -36,7 +52,7 @@ class Tucker_PPALS_Optimizer(PPALS_base, Tucker_DTALS_Optimizer):
     """
     def __init__(self, tenpy, T, A, args):
         PPALS_base.__init__(self, tenpy, T, A, args)
-        Tucker_DTALS_Optimizer.__init__(self, tenpy, T, A)
+        Tucker_DTALS_Optimizer.__init__(self, tenpy, T, A, args)
 
     def _get_einstr(self, nodeindex, parent_nodeindex, contract_index):
         """Build the Einstein string for the contraction. 
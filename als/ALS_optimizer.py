@@ -2,14 +2,29 @@ import numpy as np
 import time
 import abc, six
 import collections
-try:
-    import Queue as queue
-except ImportError:
-    import queue
+import heapq
+import itertools
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from .dimension_tree import build_tree, tree_cost, tree_to_str
+from .sweep_plan import SweepPlan, budgeted_plan
+from .pp_store import PPOperatorStore
+from .pp_controller import PPRestartController
 
 @six.add_metaclass(abc.ABCMeta)
 class DTALS_base():
     """Dimension tree for ALS optimizer
+
+    Attributes:
+        dim_tree (tuple): dimension tree swept by step, see als.dimension_tree.
+        order (int): order of the input tensor.
+        mode_order (str): 'index' updates and contracts modes by index, 'size'
+            updates the smallest modes first and contracts the largest modes first.
+        root_modes (list): modes of T_root in the order of its axes.
+        T_root (tensor): tensor at the root of the dimension tree, T itself or a
+            copy of T with its axes permuted to root_modes.
+        plan (SweepPlan): dense sweep over dim_tree, compiled on the first step.
+        workspace_budget (int): bound in bytes on the memory of the sweep
+            intermediates, which recomputes nodes to stay under it. 0 for none.
     """
 
     def __init__(self,tenpy,T,A,args):
@@ -18,17 +33,93 @@ class DTALS_base():
         self.A = A
         self.R = A[0].shape[1]
         self.sp = args.sp
+        self.order = len(A)
+        self.mode_order = getattr(args, 'mode_order', 'index')
+        self.root_modes = list(range(self.order))
+        self.T_root = T
+        self.plan = None
+        self.workspace_budget = int(getattr(args, 'workspace_budget', 0) * 2**20)
+        tree_shape = getattr(args, 'tree_shape', 'left')
+        self.dim_tree = build_tree(tree_shape, self._update_order(), self._edge_cost)
+        self.tenpy.printf("Dimension tree", tree_to_str(self.dim_tree), "costs",
+                          int(tree_cost(self.dim_tree, self._edge_cost)), "flops per sweep")
 
     @abc.abstractmethod
     def _einstr_builder(self,M,s,ii):
         return
 
     @abc.abstractmethod
-    def _solve(self,i,Regu,s):
+    def _edge_cost(self,parent,child):
+        """Flop count of contracting the tensor of the node with modes parent
+        down to the node with modes child.
+        """
         return
 
+    def _update_order(self):
+        """Order in which the modes are updated, i.e. the leaves of the dimension tree.
+
+        With mode_order 'size' the largest modes come last, so the left-deep tree
+        splits them off first and the deeper intermediates stay small.
+        """
+        if self.mode_order == 'size':
+            return sorted(range(self.order), key=lambda j: (self.T.shape[j], j))
+        return list(range(self.order))
+
+    def _contraction_order(self,modes):
+        """Order in which the factors of modes are contracted along a tree edge.
+
+        With mode_order 'size' the largest modes are contracted first, which
+        shrinks the intermediates the most and never contracts a big tensor
+        against a tiny mode.
+        """
+        if self.mode_order == 'size':
+            return sorted(modes, key=lambda j: (self.T.shape[j], j), reverse=True)
+        return sorted(modes, reverse=True)
+
+    def _contract(self,s,ii,out=None):
+        """Contract the tensor on top of the stack s with the factor of mode ii,
+        writing the result to out where the backend supports it.
+        """
+        einstr = self._einstr_builder(s[-1][1],s,ii)
+        return self.tenpy.einsum(einstr,s[-1][1],self.A[ii])
+
     @abc.abstractmethod
+    def _node_shape(self,modes):
+        """Shape of the dimension tree intermediate of the modes not yet contracted.
+        """
+        return
+
+    def _workspace_alloc(self):
+        """Allocator of the sweep plan buffers, None to let every contraction
+        allocate its own output.
+        """
+        return None
+
+    def _compile_plan(self):
+        dtype = np.result_type(self.T_root.dtype, self.A[0].dtype)
+        args = (self.dim_tree, self.root_modes, self._contraction_order, self._node_shape,
+                dtype.itemsize, self._workspace_alloc())
+        if self.workspace_budget:
+            plan = budgeted_plan(*args, edge_cost=self._edge_cost, budget=self.workspace_budget)
+        else:
+            plan = SweepPlan(*args, edge_cost=self._edge_cost)
+        self.tenpy.printf("Sweep plan has", plan.num_contractions, "contractions, peak intermediate memory",
+                          plan.peak_bytes / 2.**20, "MB, preallocated", plan.nbytes / 2.**20, "MB")
+        if plan.recompute:
+            self.tenpy.printf("Recomputing", len(plan.recompute), "nodes costs", int(plan.recompute_flops),
+                              "extra flops per sweep, an overhead of",
+                              100. * plan.recompute_flops / (plan.flops - plan.recompute_flops), "percent")
+        if plan.peak_bytes > self.workspace_budget > 0:
+            self.tenpy.printf("Warning: the sweep needs", plan.peak_bytes / 2.**20,
+                              "MB, more than the workspace budget")
+        return plan
+
+    @abc.abstractmethod
+    def _solve(self,i,Regu,s):
+        return
+
     def _sp_solve(self,i,Regu,g):
+        # only optimizers that accept sparse tensors override this
         return 
 
     def step(self,Regu):
@@ -41,31 +132,21 @@ class DTALS_base():
                 self.tenpy.MTTKRP(self.T,lst,i)
                 self.A[i] = self._sp_solve(i,Regu,lst[i])
         else:
-            q = queue.Queue()
-            for i in range(len(self.A)):
-                q.put(i)
-            s = [(list(range(len(self.A))),self.T)]
-            while not q.empty():
-                i = q.get()
-                while i not in s[-1][0]:
-                    s.pop()
-                    assert(len(s) >= 1)
-                while len(s[-1][0]) != 1:
-                    M = s[-1][1]
-                    idx = s[-1][0].index(i)
-                    ii = len(s[-1][0])-1
-                    if idx == len(s[-1][0])-1:
-                        ii = len(s[-1][0])-2
-
-                    einstr = self._einstr_builder(M,s,ii)
-                    N = self.tenpy.einsum(einstr,M,self.A[ii])
-
-                    ss = s[-1][0][:]
-                    ss.remove(ii)
-                    s.append((ss,N))
-                self.A[i] = self._solve(i,Regu,s)
+            if self.plan is None:
+                self.plan = self._compile_plan()
+            self.plan.run(self.T_root,
+                          lambda modes, M, ii, out: self._contract([(modes,M)],ii,out),
+                          lambda i, M: self._update_mode(i,Regu,M))
         return self.A
 
+    def _update_mode(self,i,Regu,M):
+        self.A[i] = self._solve(i,Regu,[([i],M)])
+
+    def close(self):
+        """Release the threads of the optimizer at the end of a run.
+        """
+        return
+
 
 @six.add_metaclass(abc.ABCMeta)
 class PPALS_base():
@@ -75,9 +156,31 @@ class PPALS_base():
         pp (bool): using pairwise perturbation or dimension tree to update.
         reinitialize_tree (bool): reinitialize the dimension tree or not.
         tol_restart_dt (float): tolerance for restarting dimention tree.
-        tree (dictionary): store the PP dimention tree.
+        tree (PPOperatorStore): store the PP dimention tree.
         order (int): order of the input tensor.
         dA (list): list of perturbation terms.
+        pp_budget (int): memory budget in bytes of the PP tree, 0 for none.
+            Operators that do not fit are spilled to disk if pp_spill_dir is
+            set, and if the tree still does not fit PP is never switched on.
+        pp_dtype (dtype): storage dtype of the PP operators, None for the
+            dtype they are computed in.
+        pp_spill_dir (str): directory of the spilled operators, '' to disable
+            spilling.
+        pp_schedule (list): tree nodes in initialization order, see
+            _compile_pp_tree.
+        pp_threads (int): number of tree nodes contracted concurrently when
+            the tree is initialized.
+        pp_triplets (bool): keep the triplet operators in the tree and add the
+            largest second order corrections that are cheaper than a DT
+            restart to every PP step.
+        triplet_terms (list): second order corrections (i,j,k) of the next PP
+            step, to the MTTKRP of mode i with dA[j] and dA[k].
+        pp_modes (list): modes updated by pairwise perturbation in a PP step,
+            the tree only holds the operators they read. The other modes are
+            updated by _step_exact_modes after them.
+        controller (PPRestartController): adaptive switching between DT and
+            PP steps, None to switch on tol_restart_dt.
+        pp_decision (str): last decision of the controller.
 
     References:
         Linjian Ma and Edgar Solomonik; Accelerating Alternating Least Squares for Tensor Decomposition
@@ -98,6 +201,21 @@ class PPALS_base():
         self.dA = []
         for i in range(self.order):
             self.dA.append(tenpy.zeros((self.A[i].shape[0],self.A[i].shape[1])))
+        self.pp_budget = int(getattr(args, 'pp_budget', 0) * 2**20)
+        pp_dtype = getattr(args, 'pp_dtype', 'float64')
+        self.pp_dtype = None if pp_dtype == 'float64' else np.dtype(pp_dtype)
+        self.pp_spill_dir = getattr(args, 'pp_spill_dir', '')
+        self.pp_threads = getattr(args, 'pp_threads', 1)
+        self.pp_triplets = bool(getattr(args, 'pp_triplets', 0))
+        self.triplet_terms = []
+        self.pp_modes = list(range(self.order))
+        self.pp_plan = self._compile_pp_step()
+        self.pp_schedule = self._compile_pp_tree()
+        self._pp_memory = None
+        self.controller = None
+        if getattr(args, 'pp_adaptive', 0):
+            self.controller = PPRestartController(self.tol_restart_dt)
+        self.pp_decision = ''
 
     @abc.abstractmethod
     def _step_dt(self,Regu):
@@ -125,6 +243,13 @@ class PPALS_base():
         """
         return
 
+    def _contract_node(self, nodeindex, parent_nodeindex, contract_index, M, X):
+        """Contract the tensor M of node parent_nodeindex with the matrix X of mode
+        contract_index, giving the tensor of node nodeindex.
+        """
+        einstr = self._get_einstr(nodeindex,parent_nodeindex,contract_index)
+        return self.tenpy.einsum(einstr,M,X)
+
     def _get_nodename(self, nodeindex):
         """Based on the index, output the node name used for the key of self.tree.
 
@@ -167,41 +292,308 @@ class PPALS_base():
 
         return parent_nodename, parent_index, contract_index
 
-    def _initialize_treenode(self, nodeindex):
-        """Initialize one node in self.tree
+    def _compile_pp_step(self):
+        """List the tree nodes every mode of a pairwise perturbation step reads.
 
-        Args:
-            nodeindex (numpy array): The target node index
+        Returns:
+            (list) for every mode i, the node name of i and the tuples
+            (parent node name, parent node index, j) of the pairs (i,j), None
+            if i is not in pp_modes.
 
         """
-        nodename = self._get_nodename(nodeindex)
-        parent_nodename, parent_nodeindex, contract_index = self._get_parentnode(nodeindex)
-        einstr = self._get_einstr(nodeindex,parent_nodeindex,contract_index)
+        plan = []
+        for i in range(self.order):
+            if i not in self.pp_modes:
+                plan.append(None)
+                continue
+            terms = []
+            for j in range(self.order):
+                if j != i:
+                    parent_nodeindex = np.array([min(i,j),max(i,j)])
+                    terms.append((self._get_nodename(parent_nodeindex),parent_nodeindex,j))
+            plan.append((self._get_nodename(np.array([i])),terms))
+        return plan
+
+    def _compile_pp_tree(self):
+        """List the nodes of the PP tree in initialization order.
+
+        Every node is contracted from its parent, so the operators of the PP
+        step come after the ancestors they derive from. Pairs that share
+        ancestors are formed one after the other, and a node the PP step does
+        not read is dropped as soon as the last node derived from it is formed.
 
-        if not parent_nodename in self.tree:
-            self._initialize_treenode(parent_nodeindex)
+        Returns:
+            (list) tuples (nodeindex, node name, parent node name, parent node
+            index, contract index, names of the nodes to drop afterwards).
 
-        # t0 = time.time()
-        N = self.tenpy.einsum(einstr,self.tree[parent_nodename][1],self.A[contract_index])
-        # t1 = time.time()
-        self.tree[nodename] = (nodeindex,N)
-        # self.tenpy.printf(einstr)
-        # self.tenpy.printf("!!!!!!!! pairwise perturbation initialize tree took", t1-t0,"seconds")
+        """
+        schedule = []
+        parents = {}
+        def visit(nodeindex):
+            nodename = self._get_nodename(nodeindex)
+            if nodename == '0' or nodename in parents:
+                return
+            parent_nodename, parent_nodeindex, contract_index = self._get_parentnode(nodeindex)
+            visit(parent_nodeindex)
+            parents[nodename] = parent_nodename
+            schedule.append([nodeindex, nodename, parent_nodename, parent_nodeindex, contract_index])
+
+        # the ancestors of a node are set by the last modes it is not
+        # contracted with, so grouping on them keeps few ancestors alive
+        fulllist = np.array(range(self.order))
+        ancestry = lambda nodeindex: list(np.setdiff1d(fulllist, nodeindex))[::-1]
+        if self.pp_triplets:
+            for nodeindex in sorted(self._triplets(), key=ancestry):
+                visit(nodeindex)
+        pairs = [np.array([ii,jj]) for ii in range(self.order) for jj in range(ii+1, self.order)
+                 if ii in self.pp_modes or jj in self.pp_modes]
+        pairs.sort(key=ancestry)
+        singles = [np.array([ii]) for ii in self.pp_modes]
+        for nodeindex in pairs:
+            visit(nodeindex)
+            # the single mode nodes of a pair right away, so it can be dropped
+            for single in singles:
+                if self._get_parentnode(single)[0] == self._get_nodename(nodeindex):
+                    visit(single)
+
+        operators = self._pp_operators()
+        last_use = {}
+        for k, entry in enumerate(schedule):
+            last_use[entry[1]] = k
+        for k, entry in enumerate(schedule):
+            last_use[entry[2]] = k
+        for entry in schedule:
+            entry.append([])
+        for nodename, k in last_use.items():
+            if nodename != '0' and nodename not in operators:
+                schedule[k][5].append(nodename)
+        return [tuple(entry) for entry in schedule]
+
+    def _pp_operators(self):
+        """Names of the tree nodes read by the PP step.
+        """
+        operators = set()
+        stacks = self._pp_stack_shapes()
+        for nodename, terms in filter(None, self.pp_plan):
+            operators.add(nodename)
+            if not stacks:
+                operators.update(parentname for parentname, _, _ in terms)
+        if self.pp_triplets:
+            operators.update(self._get_nodename(nodeindex) for nodeindex in self._triplets())
+            operators.discard('0')
+        return operators | set(stacks)
+
+    def _set_pp_modes(self, modes):
+        """Perturb only modes in the next PP steps, which recompiles the tree.
+        """
+        modes = sorted(modes)
+        if modes == self.pp_modes:
+            return
+        self.pp_modes = modes
+        self.pp_plan = self._compile_pp_step()
+        self.pp_schedule = self._compile_pp_tree()
+        self._pp_memory = None
+
+    def _triplets(self):
+        return [np.array(t) for t in itertools.combinations(range(self.order), 3)]
+
+    def _triplet_term(self, i, j, k):
+        """Second order correction of the MTTKRP of mode i, the triplet
+        operator of (i,j,k) contracted with dA[k] and dA[j].
+        """
+        triple = np.array(sorted([i, j, k]))
+        pair = np.array(sorted([i, j]))
+        M = self.tree[self._get_nodename(triple)][1]
+        M = self._contract_node(pair, triple, k, M, self.dA[k])
+        return self._contract_node(np.array([i]), pair, j, M, self.dA[j])
+
+    def _restart_cost(self):
+        """Flops of a DT sweep and a reinitialization of the PP tree.
+        """
+        cost = tree_cost(self.dim_tree, self._edge_cost)
+        for nodeindex, _, _, parent_nodeindex, _, _ in self.pp_schedule:
+            cost += self._edge_cost(list(parent_nodeindex), list(nodeindex))
+        return cost
+
+    def _select_triplet_terms(self, rel):
+        """Select the second order corrections of the next PP step given the
+        relative norms rel of dA.
+
+        The term of mode i with dA[j] and dA[k] is of the size of
+        rel[j]*rel[k], so the terms are taken largest first while their flops
+        per sweep stay below those of a DT restart. They only make the PP
+        step more accurate; when to leave PP is decided as without them.
+        """
+        self.triplet_terms = []
+        if not self.pp_triplets:
+            return
+        candidates = []
+        for i in self.pp_modes:
+            for j, k in itertools.combinations([j for j in range(self.order) if j != i], 2):
+                candidates.append((rel[j] * rel[k], i, j, k))
+        budget = self._restart_cost()
+        cost = 0
+        for _, i, j, k in sorted(candidates, reverse=True):
+            triple = sorted([i, j, k])
+            pair = sorted([i, j])
+            cost += self._edge_cost(triple, pair) + self._edge_cost(pair, [i])
+            if cost >= budget:
+                break
+            self.triplet_terms.append((i, j, k))
+
+    def _pp_stack_shapes(self):
+        """Shapes by name of the operators the pair nodes are stacked into for
+        a fused PP step, empty if the pair nodes are read one at a time.
+        """
+        return {}
+
+    def _stack_pp_node(self, nodeindex, N):
+        """Copy the tensor N of the tree node nodeindex into the stacked
+        operators.
+        """
+        return
+
+    def _pp_mttkrp(self, i):
+        """Pairwise perturbation approximation of the MTTKRP of mode i, the
+        single mode node of i corrected with every pair (i,j) and dA[j].
+        """
+        nodename, terms = self.pp_plan[i]
+        nodeindex = np.array([i])
+        N = self.tree[nodename][1]
+        for k, (parentname, parent_nodeindex, j) in enumerate(terms):
+            term = self._contract_node(nodeindex, parent_nodeindex, j,
+                                       self.tree[parentname][1], self.dA[j])
+            if k == 0:
+                N = N + term
+            else:
+                N += term
+        return N
+
+    def _plan_pp_memory(self):
+        """Simulate the initialization of the PP tree under pp_budget.
+
+        Returns:
+            peak (int): largest memory in bytes used by the tree nodes.
+            spill (set): names of the operators spilled to disk.
+
+        """
+        operators = self._pp_operators()
+        itemsize = np.result_type(self.T.dtype, self.A[0].dtype).itemsize
+        stored_itemsize = itemsize if self.pp_dtype is None else self.pp_dtype.itemsize
+        size = lambda nodeindex: int(np.prod(self._node_shape(list(nodeindex))))
+        # memory of the ancestors alive while each node is formed
+        sizes = {}
+        transient = []
+        live = 0
+        for nodeindex, nodename, _, _, _, drop in self.pp_schedule:
+            sizes[nodename] = size(nodeindex) * itemsize
+            transient.append(live + sizes[nodename])
+            if nodename not in operators:
+                live += sizes[nodename]
+            for name in drop:
+                live -= sizes[name]
+        # an operator kept in memory has to fit next to every later transient
+        future = transient[:]
+        for k in range(len(future) - 2, -1, -1):
+            future[k] = max(future[k], future[k + 1])
+        resident, peak = 0, 0
+        spill = set()
+        # stacked operators are allocated before the tree is formed
+        for nodename, shape in sorted(self._pp_stack_shapes().items()):
+            stored = int(np.prod(shape)) * stored_itemsize
+            if self.pp_budget and self.pp_spill_dir and \
+                    resident + stored + future[0] > self.pp_budget:
+                spill.add(nodename)
+            else:
+                resident += stored
+        for k, (nodeindex, nodename, _, _, _, _) in enumerate(self.pp_schedule):
+            peak = max(peak, resident + transient[k])
+            if nodename in operators:
+                stored = size(nodeindex) * stored_itemsize
+                if self.pp_budget and self.pp_spill_dir and \
+                        resident + stored + future[k] > self.pp_budget:
+                    spill.add(nodename)
+                else:
+                    resident += stored
+        return max(peak, resident), spill
+
+    def _pp_fits(self):
+        if self._pp_memory is None:
+            self._pp_memory = self._plan_pp_memory()
+            peak, spill = self._pp_memory
+            self.tenpy.printf("PP tree needs", peak / 2.**20, "MB with", len(spill),
+                              "operators spilled to disk")
+            if self.pp_budget and peak > self.pp_budget:
+                self.tenpy.printf("PP tree does not fit in the budget, using dimension tree sweeps only")
+        return self.pp_budget == 0 or self._pp_memory[0] <= self.pp_budget
 
     def _initialize_tree(self):
         """Initialize self.tree
         """
-        self.tree = { '0':(list(range(len(self.A))),self.T) }
+        if isinstance(self.tree, PPOperatorStore):
+            self.tree.clear()
+        spill = self._pp_memory[1] if self._pp_memory is not None else ()
+        self.tree = PPOperatorStore(self.tenpy, self._pp_operators(), self.pp_dtype,
+                                    spill, self.pp_spill_dir or None)
+        self.tree['0'] = (list(range(len(self.A))),self.T)
         self.dA = []
         for i in range(self.order):
             self.dA.append(self.tenpy.zeros((self.A[i].shape[0],self.A[i].shape[1])))
-
-        for ii in range(0, self.order):
-            for jj in range(ii+1, self.order):
-                self._initialize_treenode(np.array([ii,jj]))
-
-        for ii in range(0, self.order):
-            self._initialize_treenode(np.array([ii]))
+        for nodename, shape in sorted(self._pp_stack_shapes().items()):
+            self.tree[nodename] = (None, self.tenpy.zeros(shape))
+
+        if self.pp_threads > 1:
+            self._initialize_tree_parallel()
+            return
+        for nodeindex, nodename, parent_nodename, parent_nodeindex, contract_index, drop in self.pp_schedule:
+            N = self._contract_node(nodeindex,parent_nodeindex,contract_index,
+                                    self.tree[parent_nodename][1],self.A[contract_index])
+            self.tree[nodename] = (nodeindex,N)
+            self._stack_pp_node(nodeindex, N)
+            for name in drop:
+                del self.tree[name]
+
+    def _initialize_tree_parallel(self):
+        """Form the nodes of pp_schedule on pp_threads threads.
+
+        A node can be contracted once its parent exists, so nodes on different
+        branches of the tree overlap. The contractions run on the pool while the
+        tree itself is only updated here. At most pp_threads nodes are in flight
+        and the ready ones are started in schedule order, which keeps the number
+        of live ancestors close to the sequential initialization. A node the PP
+        step does not read is dropped once all its children are formed.
+        """
+        operators = self._pp_operators()
+        children = collections.defaultdict(list)
+        for k, entry in enumerate(self.pp_schedule):
+            children[entry[2]].append(k)
+        left = dict((name, len(ks)) for name, ks in children.items())
+        ready = list(children['0'])
+        heapq.heapify(ready)
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.pp_threads) as pool:
+            while ready or running:
+                while ready and len(running) < self.pp_threads:
+                    k = heapq.heappop(ready)
+                    nodeindex, _, parent_nodename, parent_nodeindex, contract_index, _ = self.pp_schedule[k]
+                    future = pool.submit(self._contract_node, nodeindex, parent_nodeindex,
+                                         contract_index, self.tree[parent_nodename][1],
+                                         self.A[contract_index])
+                    running[future] = k
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    k = running.pop(future)
+                    nodeindex, nodename, parent_nodename = self.pp_schedule[k][:3]
+                    N = future.result()
+                    self.tree[nodename] = (nodeindex, N)
+                    self._stack_pp_node(nodeindex, N)
+                    for child in children.get(nodename, []):
+                        heapq.heappush(ready, child)
+                    left[parent_nodename] -= 1
+                    for name in (nodename, parent_nodename):
+                        if left.get(name, 0) == 0 and name != '0' and name not in operators \
+                                and name in self.tree:
+                            del self.tree[name]
 
     def _step_pp_subroutine(self,Regu):
         """Doing one step update based on pairwise perturbation
@@ -214,34 +606,49 @@ class PPALS_base():
 
         """
         print("***** pairwise perturbation step *****")
-        for i in range(self.order):
-            nodename = self._get_nodename(np.array([i]))
-            N = self.tree[nodename][1][:]
-
-            for j in range(i):
-                parentname = self._get_nodename(np.array([j,i]))
-                einstr = self._get_einstr(np.array([i]), np.array([j,i]), j)
-                N = N + self.tenpy.einsum(einstr,self.tree[parentname][1],self.dA[j])
-            for j in range(i+1, self.order):
-                parentname = self._get_nodename(np.array([i,j]))
-                einstr = self._get_einstr(np.array([i]), np.array([i,j]), j)
-                N = N + self.tenpy.einsum(einstr,self.tree[parentname][1],self.dA[j])
-
+        for i in self.pp_modes:
+            N = self._pp_mttkrp(i)
+            for ii, j, k in self.triplet_terms:
+                if ii == i:
+                    N += self._triplet_term(i, j, k)
             output = self._solve_PP(i,Regu,N)
-            self.dA[i] = self.dA[i] + output - self.A[i]
+            self.dA[i] += output
+            self.dA[i] -= self.A[i]
             self.A[i] = output
+        self._step_exact_modes(Regu)
 
-        num_smallupdate = 0
-        for i in range(self.order):
-            if self.tenpy.sum(self.dA[i]**2)**.5 / self.tenpy.sum(self.A[i]**2)**.5 > self.tol_restart_dt:
-                num_smallupdate += 1
-
-        if num_smallupdate > 0:
+        rel = self._relative_updates()
+        if self._leave_pp(rel):
             self.pp = False
             self.reinitialize_tree = False
+            self.triplet_terms = []
+        else:
+            self._select_triplet_terms(rel)
+            if self.triplet_terms:
+                self.tenpy.printf("Adding", len(self.triplet_terms), "triplet corrections to the next PP step")
 
         return self.A
 
+    def _step_exact_modes(self, Regu):
+        """Update the modes that are not in pp_modes at the end of a PP step.
+        """
+        return
+
+    def _leave_pp(self, rel):
+        """Decide after a PP step whether to switch back to DT given the
+        relative norms rel of dA.
+        """
+        if self.controller is not None:
+            return self.controller.leave_pp(rel)
+        return max(rel) > self.tol_restart_dt
+
+    def _enter_pp(self, rel):
+        """Decide after a DT step whether to switch to PP given the relative
+        norms rel of dA.
+        """
+        if self.controller is not None:
+            return self.controller.enter_pp(rel)
+        return max(rel) < self.tol_restart_dt
 
     def _step_dt_subroutine(self,Regu):
         """Doing one step update based on dimension tree
@@ -255,17 +662,23 @@ class PPALS_base():
         """
         A_prev = self.A[:]
         self._step_dt(Regu)
-        num_smallupdate = 0
         for i in range(self.order):
             self.dA[i] = self.A[i] - A_prev[i]
-            if self.tenpy.sum(self.dA[i]**2)**.5 / self.tenpy.sum(self.A[i]**2)**.5 < self.tol_restart_dt:
-                num_smallupdate += 1
-
-        if num_smallupdate == self.order:
+        if self._enter_pp(self._relative_updates()) and self._pp_fits():
             self.pp = True
             self.reinitialize_tree = True
         return self.A
 
+    def _relative_updates(self):
+        return [self.tenpy.sum(self.dA[i]**2)**.5 / self.tenpy.sum(self.A[i]**2)**.5
+                for i in range(self.order)]
+
+    def record_fitness(self, fitness):
+        """Report the fitness of the current iterate to the controller.
+        """
+        if self.controller is not None:
+            self.controller.record_fitness(fitness)
+
     def step(self,Regu):
         """Doing one step update in the optimizer
 
@@ -277,6 +690,8 @@ class PPALS_base():
 
         """
         restart = False
+        t0 = time.time()
+        kind = 'pp' if self.pp else 'dt'
         if self.pp:
             if self.reinitialize_tree:
                 restart = True
@@ -285,5 +700,8 @@ class PPALS_base():
             A = self._step_pp_subroutine(Regu)
         else:
             A = self._step_dt_subroutine(Regu)
+        if self.controller is not None:
+            self.controller.record_step(kind, time.time() - t0)
+            self.pp_decision = self.controller.decision
         return A, restart
 
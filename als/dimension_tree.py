@@ -0,0 +1,96 @@
+"""Shapes of the dimension trees used by the ALS optimizers.
+
+A dimension tree is a nested tuple: a leaf is a mode index and an internal
+node is a pair (left, right). Modes are updated in the order the leaves appear
+from left to right, and the tensor of a child node is the tensor of its parent
+contracted with the factors of the modes of its sibling.
+"""
+
+
+def leaves(tree):
+    """List the modes of a dimension tree in update order.
+    """
+    if isinstance(tree, tuple):
+        return leaves(tree[0]) + leaves(tree[1])
+    return [tree]
+
+
+def left_deep_tree(modes):
+    """Tree that peels one mode at a time off the end, e.g. (((0,1),2),3).
+    """
+    tree = modes[0]
+    for j in modes[1:]:
+        tree = (tree, j)
+    return tree
+
+
+def balanced_tree(modes):
+    """Tree that splits the modes into halves at every level, e.g. ((0,1),(2,3)).
+    """
+    if len(modes) == 1:
+        return modes[0]
+    half = (len(modes) + 1) // 2
+    return (balanced_tree(modes[:half]), balanced_tree(modes[half:]))
+
+
+def optimal_tree(modes, edge_cost):
+    """Tree with the minimum total contraction cost among all binary trees that
+    keep the update order of modes.
+
+    Args:
+        modes (list): modes in update order.
+        edge_cost (function): edge_cost(parent, child) returns the cost of
+            contracting the tensor of node parent down to node child, where
+            both are lists of modes.
+
+    Returns:
+        (tuple) the dimension tree.
+
+    """
+    n = len(modes)
+    best = {}
+    for length in range(1, n + 1):
+        for l in range(n - length + 1):
+            r = l + length
+            if length == 1:
+                best[(l, r)] = (0, modes[l])
+                continue
+            parent = modes[l:r]
+            for k in range(l + 1, r):
+                cost = best[(l, k)][0] + best[(k, r)][0] + \
+                    edge_cost(parent, modes[l:k]) + edge_cost(parent, modes[k:r])
+                if (l, r) not in best or cost < best[(l, r)][0]:
+                    best[(l, r)] = (cost, (best[(l, k)][1], best[(k, r)][1]))
+    return best[(0, n)][1]
+
+
+def tree_cost(tree, edge_cost, parent=None):
+    """Total contraction cost of one sweep over a dimension tree.
+    """
+    if parent is None:
+        parent = leaves(tree)
+    if not isinstance(tree, tuple):
+        return 0
+    cost = 0
+    for child in tree:
+        child_modes = leaves(child)
+        cost += edge_cost(parent, child_modes) + tree_cost(child, edge_cost, child_modes)
+    return cost
+
+
+def build_tree(shape, modes, edge_cost):
+    """Build a dimension tree of the given shape ('left', 'balanced' or 'optimal').
+    """
+    if shape == 'left':
+        return left_deep_tree(modes)
+    elif shape == 'balanced':
+        return balanced_tree(modes)
+    elif shape == 'optimal':
+        return optimal_tree(modes, edge_cost)
+    raise ValueError('Unknown dimension tree shape: ' + str(shape))
+
+
+def tree_to_str(tree):
+    if isinstance(tree, tuple):
+        return "(" + tree_to_str(tree[0]) + "," + tree_to_str(tree[1]) + ")"
+    return str(tree)
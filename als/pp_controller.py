@@ -0,0 +1,121 @@
+class PPRestartController():
+    """Adaptive switching between dimension tree and pairwise perturbation sweeps.
+
+    The approximation error of a PP step is second order in the updates since
+    the tree was formed, so it is estimated by the product of the two largest
+    relative norms of dA. PP is entered when the estimate falls below tol^2 and
+    left when it rises above it or when a PP step lowers the fitness.
+
+    The fitness gained per second is tracked separately for DT and PP steps,
+    counting the tree initialization as part of PP. When a PP phase ends, tol
+    is loosened if the phase gained fitness faster than DT sweeps do and
+    tightened otherwise. While DT sweeps gain fitness slower than the last PP
+    phase did, or before the first PP phase at half their best rate, tol is
+    loosened to give PP another try.
+
+    Attributes:
+        tol (float): current tolerance on the relative norms of dA.
+        min_tol (float): lower bound of tol.
+        max_tol (float): upper bound of tol.
+        elapsed (float): time spent in steps so far.
+        rate (dict): smoothed fitness gain per second of 'dt' and 'pp' steps.
+        best_dt_rate (float): largest fitness gain per second of DT steps.
+        phase_rate (float): fitness gain per second of the last PP phase.
+        decision (str): last decision, logged to the run csv.
+
+    """
+    def __init__(self, tol, min_tol=1e-4, max_tol=0.5):
+        self.tol = tol
+        self.min_tol = min_tol
+        self.max_tol = max_tol
+        self.elapsed = 0.
+        self.rate = {}
+        self.best_dt_rate = 0.
+        self.phase_rate = None
+        self.decision = ''
+        self.fitness = None
+        self._kind = None
+        self._sample = None
+        self._phase_start = None
+        self._phase_pending = False
+        self._fitness_dropped = False
+
+    def record_step(self, kind, seconds):
+        """Account a 'dt' or 'pp' step that took seconds.
+        """
+        self.elapsed += seconds
+        if self._kind is None:
+            self._kind = kind
+        elif self._kind != kind:
+            self._kind = 'mixed'
+
+    def record_fitness(self, fitness):
+        """Account the fitness of the current iterate.
+        """
+        if self._sample is not None and self._kind in ('dt', 'pp'):
+            t, f = self._sample
+            if self.elapsed > t:
+                rate = (fitness - f) / (self.elapsed - t)
+                if self._kind in self.rate:
+                    rate = .5 * (self.rate[self._kind] + rate)
+                self.rate[self._kind] = rate
+                if self._kind == 'dt':
+                    self.best_dt_rate = max(self.best_dt_rate, rate)
+            if self._kind == 'pp':
+                self._fitness_dropped = fitness < f
+        if self._phase_pending:
+            self._phase_start = (self.elapsed, fitness)
+            self._phase_pending = False
+        self._sample = (self.elapsed, fitness)
+        self.fitness = fitness
+        self._kind = None
+
+    def error_estimate(self, rel):
+        """Estimated relative error of a PP step given the relative norms rel
+        of dA.
+        """
+        top = sorted(rel)[-2:]
+        return top[0] * top[-1]
+
+    def enter_pp(self, rel):
+        """Decide after a DT step whether to switch to PP.
+        """
+        est = self.error_estimate(rel)
+        self.decision = 'dt'
+        if est >= self.tol**2 and 'dt' in self.rate:
+            if self.phase_rate is None:
+                stalled = self.rate['dt'] < .5 * self.best_dt_rate
+            else:
+                stalled = self.rate['dt'] < self.phase_rate
+            if stalled and self.tol < self.max_tol:
+                self.tol = min(2 * self.tol, self.max_tol)
+                self.decision = 'dt stalled; loosen tol to %g' % self.tol
+        if est < self.tol**2:
+            self.decision = 'enter pp; error estimate %.3g; tol %g' % (est, self.tol)
+            self._phase_pending = True
+            return True
+        return False
+
+    def leave_pp(self, rel):
+        """Decide after a PP step whether to switch back to DT.
+        """
+        est = self.error_estimate(rel)
+        if self._fitness_dropped:
+            reason = 'fitness dropped'
+        elif est > self.tol**2:
+            reason = 'error estimate %.3g' % est
+        else:
+            self.decision = 'pp'
+            return False
+        self._fitness_dropped = False
+        faster = False
+        if self._phase_start is not None and self.elapsed > self._phase_start[0]:
+            self.phase_rate = (self.fitness - self._phase_start[1]) / (self.elapsed - self._phase_start[0])
+            faster = 'dt' in self.rate and self.phase_rate > self.rate['dt']
+        if faster and reason != 'fitness dropped':
+            self.tol = min(1.5 * self.tol, self.max_tol)
+        else:
+            self.tol = max(.5 * self.tol, self.min_tol)
+        self._phase_start = None
+        self.decision = 'leave pp; %s; tol %g' % (reason, self.tol)
+        return True
@@ -0,0 +1,71 @@
+import numpy as np
+import tempfile
+
+
+class PPOperatorStore():
+    """Nodes of the pairwise perturbation tree by node name.
+
+    Behaves as the dictionary of (node index, tensor) it replaces. The nodes
+    named in operators are the ones pairwise perturbation steps read. With the
+    numpy backend they can be stored in a reduced precision dtype, and the ones
+    named in spill are written to a memory-mapped temporary file instead of
+    being kept in memory. Every other node is stored as is.
+
+    Attributes:
+        operators (set): names of the operator nodes.
+        dtype (dtype): storage dtype of the operators, None to keep theirs.
+        spill (set): names of the operators that are memory-mapped.
+        spill_dir (str): directory of the memory-mapped files, None for the
+            default temporary directory.
+        resident_bytes (int): size of the operators kept in memory.
+        spilled_bytes (int): size of the memory-mapped operators.
+
+    """
+    def __init__(self, tenpy, operators, dtype=None, spill=(), spill_dir=None):
+        self.tenpy = tenpy
+        self.operators = set(operators)
+        self.dtype = dtype
+        self.spill = set(spill)
+        self.spill_dir = spill_dir
+        self.resident_bytes = 0
+        self.spilled_bytes = 0
+        self._nodes = {}
+        self._files = {}
+
+    def __contains__(self, name):
+        return name in self._nodes
+
+    def __getitem__(self, name):
+        return self._nodes[name]
+
+    def __setitem__(self, name, node):
+        if name in self._nodes:
+            del self[name]
+        nodeindex, N = node
+        if name in self.operators and self.tenpy.name() == 'numpy':
+            if self.dtype is not None and N.dtype != self.dtype:
+                N = N.astype(self.dtype)
+            if name in self.spill:
+                f = tempfile.TemporaryFile(dir=self.spill_dir)
+                M = np.memmap(f, dtype=N.dtype, mode='w+', shape=N.shape)
+                M[...] = N
+                M.flush()
+                self._files[name] = f
+                self.spilled_bytes += M.nbytes
+                N = M
+            else:
+                self.resident_bytes += N.nbytes
+        self._nodes[name] = (nodeindex, N)
+
+    def __delitem__(self, name):
+        N = self._nodes.pop(name)[1]
+        if name in self._files:
+            self.spilled_bytes -= N.nbytes
+            del N
+            self._files.pop(name).close()
+        elif name in self.operators and self.tenpy.name() == 'numpy':
+            self.resident_bytes -= N.nbytes
+
+    def clear(self):
+        for name in list(self._nodes):
+            del self[name]
@@ -0,0 +1,249 @@
+import numpy as np
+from .dimension_tree import leaves, tree_cost
+
+
+class SweepPlan():
+    """One sweep over a dimension tree compiled into a flat list of operations.
+
+    The traversal of the tree, the contraction order along every edge and the
+    modes of every intermediate are resolved once. Each intermediate is
+    assigned a workspace buffer that is allocated on compilation and reused by
+    every later sweep. An intermediate gives its buffer back as soon as its last
+    contraction is done, and buffers are shared between intermediates of the
+    same shape that are never alive at the same time.
+
+    With a memory budget, the contractions along an edge run as one chain that
+    is split into blocks along a mode the edge keeps, so that only a block of
+    every transient intermediate is alive at a time. The internal nodes in
+    recompute are never formed at all, as in checkpointing for reverse mode
+    automatic differentiation: each of their children is contracted from the
+    nearest kept ancestor instead, which repeats the contractions between the
+    two.
+
+    Attributes:
+        ops (list): ('contract', src, dst, modes, mode) contracts buffer src, a
+            tensor of modes, with the factor of mode into buffer dst,
+            ('chain', src, dst, modes, steps, mode, bounds, shape) contracts
+            buffer src with the factors of steps in turn, in blocks of mode
+            given by bounds, into buffer dst of the given shape,
+            ('leaf', mode, src) hands buffer src to the update of mode and
+            ('free', src) ends the lifetime of buffer src if it is not
+            preallocated.
+            Buffer 0 is the root tensor.
+        buffers (list): workspace buffers, None where not preallocated.
+        recompute (set): modes (frozensets) of the nodes that are recomputed.
+        num_contractions (int): number of contractions per sweep.
+        flops (float): cost of one sweep, if edge_cost is given.
+        recompute_flops (float): part of flops spent on recomputation.
+        peak_bytes (int): largest total size of the intermediates alive at any
+            point of the sweep.
+        workspace_bytes (int): total size of the distinct buffers.
+        nbytes (int): total size of the preallocated workspace.
+
+    """
+    def __init__(self, tree, root_modes, contraction_order, node_shape, itemsize=8,
+                 alloc=None, edge_cost=None, recompute=(), budget=0):
+        self.ops = []
+        self.recompute = set(recompute)
+        shapes = [None]
+        self._free = {}
+        self._live = 0
+        self.peak_bytes = 0
+        self.flops = 0.
+        self.num_contractions = 0
+        self._itemsize = itemsize
+        self._shapes = shapes
+        self._order = contraction_order
+        self._node_shape = node_shape
+        self._edge_cost = edge_cost
+        self._budget = budget
+        self._visit(tree, 0, list(root_modes), (0, list(root_modes)), [])
+        self.recompute_flops = 0.
+        if edge_cost is not None:
+            self.recompute_flops = self.flops - tree_cost(tree, edge_cost)
+        self.workspace_bytes = sum(self._size(shape) for shape in shapes[1:])
+        self.buffers = [None] * len(shapes)
+        self.nbytes = 0
+        if alloc is not None:
+            for k in range(1, len(shapes)):
+                self.buffers[k] = alloc(shapes[k])
+            self.nbytes = self.workspace_bytes
+            self.ops = [op for op in self.ops if op[0] != 'free']
+        del self._free, self._shapes, self._order, self._node_shape, self._edge_cost
+
+    def _size(self, shape):
+        return int(np.prod(shape)) * self._itemsize
+
+    def _acquire(self, shape):
+        shape = tuple(shape)
+        self._live += self._size(shape)
+        self.peak_bytes = max(self.peak_bytes, self._live)
+        pool = self._free.get(shape)
+        if pool:
+            return pool.pop()
+        self._shapes.append(shape)
+        return len(self._shapes) - 1
+
+    def _release(self, k):
+        if k == 0:
+            return
+        shape = self._shapes[k]
+        self._live -= self._size(shape)
+        self._free.setdefault(shape, []).append(k)
+        self.ops.append(('free', k))
+
+    def _count(self, modes, new_modes):
+        self.num_contractions += 1
+        if self._edge_cost is not None:
+            self.flops += self._edge_cost(modes, new_modes)
+
+    def _chain(self, src, modes, steps):
+        """Emit the contraction of buffer src, a tensor of modes, with the
+        factors of steps as one chain, blocked to fit the budget.
+        """
+        sizes = []
+        cur_modes = modes
+        for ii in steps:
+            new_modes = [j for j in cur_modes if j != ii]
+            self._count(cur_modes, new_modes)
+            sizes.append(self._size(self._node_shape(new_modes)))
+            cur_modes = new_modes
+        shape = tuple(self._node_shape(cur_modes))
+        dst = self._acquire(shape)
+        # block along the largest mode kept by the chain
+        mode = max(cur_modes, key=lambda j: shape[1 + cur_modes.index(j)])
+        n = shape[1 + cur_modes.index(mode)]
+        for nblocks in range(1, n + 1):
+            frac = float(-(-n // nblocks)) / n
+            # every step but an unblocked last one writes to a temporary
+            temps = [size * frac for size in (sizes if nblocks > 1 else sizes[:-1])]
+            pairs = [temps[j] + temps[j + 1] for j in range(len(temps) - 1)]
+            transient = max(temps + pairs + [0])
+            if self._live + transient <= self._budget:
+                break
+        self.peak_bytes = max(self.peak_bytes, self._live + transient)
+        bounds = [n * b // nblocks for b in range(nblocks + 1)]
+        self.ops.append(('chain', src, dst, modes, list(steps), mode, bounds, shape))
+        return dst, cur_modes
+
+    def _visit(self, tree, src, modes, base, path):
+        """Emit the operations of the subtree tree, whose tensor of modes is in
+        buffer src, and release src. base is the buffer and modes of the nearest
+        kept ancestor and path the modes contracted from it down to this node,
+        which is only formed if it is kept.
+        """
+        if not isinstance(tree, tuple):
+            self.ops.append(('leaf', tree, src))
+            self._release(src)
+            return
+        keep = src == 0 or frozenset(modes) not in self.recompute
+        if keep:
+            base, path = (src, modes), []
+        for child, sibling in ((tree[0], tree[1]), (tree[1], tree[0])):
+            steps = path + self._order(leaves(sibling))
+            child_modes = [j for j in modes if j in leaves(child)]
+            if isinstance(child, tuple) and frozenset(child_modes) in self.recompute:
+                self._visit(child, None, child_modes, base, steps)
+                continue
+            if self._budget or path:
+                cur, cur_modes = self._chain(base[0], base[1], steps)
+            else:
+                cur, cur_modes = src, modes
+                for ii in steps:
+                    new_modes = [j for j in cur_modes if j != ii]
+                    self._count(cur_modes, new_modes)
+                    dst = self._acquire(self._node_shape(new_modes))
+                    self.ops.append(('contract', cur, dst, cur_modes, ii))
+                    if cur != src:
+                        self._release(cur)
+                    cur, cur_modes = dst, new_modes
+            self._visit(child, cur, cur_modes, base, [])
+        if keep:
+            self._release(src)
+
+    def run(self, root, contract, leaf):
+        """Execute the sweep.
+
+        Args:
+            root (tensor): tensor at the root of the tree.
+            contract (function): contract(modes, M, mode, out) returns the tensor
+                M of modes contracted with the factor of mode, written to out if
+                out is not None.
+            leaf (function): leaf(mode, M) is called with the MTTKRP of every mode.
+
+        """
+        bufs = self.buffers
+        vals = [root] + [None] * (len(bufs) - 1)
+        for op in self.ops:
+            if op[0] == 'contract':
+                _, src, dst, modes, mode = op
+                vals[dst] = contract(modes, vals[src], mode, bufs[dst])
+            elif op[0] == 'chain':
+                vals[op[2]] = self._run_chain(vals, contract, *op[1:])
+            elif op[0] == 'leaf':
+                leaf(op[1], vals[op[2]])
+            else:
+                vals[op[1]] = None
+
+    def _run_chain(self, vals, contract, src, dst, modes, steps, mode, bounds, shape):
+        M = vals[src]
+        out = self.buffers[dst]
+        if len(bounds) == 2:
+            for ii in steps[:-1]:
+                M = contract(modes, M, ii, None)
+                modes = [j for j in modes if j != ii]
+            return contract(modes, M, steps[-1], out)
+        axis = modes.index(mode) + (src != 0)
+        out_axis = 1 + [j for j in modes if j not in steps].index(mode)
+        for b0, b1 in zip(bounds[:-1], bounds[1:]):
+            index = [slice(None)] * M.ndim
+            index[axis] = slice(b0, b1)
+            B, cur_modes = M[tuple(index)], modes
+            for ii in steps:
+                B = contract(cur_modes, B, ii, None)
+                cur_modes = [j for j in cur_modes if j != ii]
+            if out is None:
+                out = np.empty(shape, dtype=B.dtype)
+            index = [slice(None)] * out.ndim
+            index[out_axis] = slice(b0, b1)
+            out[tuple(index)] = B
+        return out
+
+
+def internal_nodes(tree):
+    """Modes (frozensets) of the internal nodes of tree below the root.
+    """
+    nodes = []
+    for child in tree:
+        if isinstance(child, tuple):
+            nodes.append(frozenset(leaves(child)))
+            nodes += internal_nodes(child)
+    return nodes
+
+
+def budgeted_plan(tree, root_modes, contraction_order, node_shape, itemsize, alloc,
+                  edge_cost, budget):
+    """SweepPlan whose intermediates fit in budget bytes, with as little
+    recomputation as a greedy checkpointing schedule finds.
+
+    The preallocated plan is used if its workspace fits. Otherwise buffers are
+    allocated on demand, the edges are blocked and nodes are recomputed one at a
+    time, each time picking the node that lowers the peak the most for the
+    fewest extra flops. If the budget cannot be met, the plan with the lowest
+    peak is returned.
+    """
+    args = (tree, root_modes, contraction_order, node_shape, itemsize)
+    plan = SweepPlan(*args, edge_cost=edge_cost)
+    if alloc is not None and plan.workspace_bytes <= budget:
+        return SweepPlan(*args, alloc=alloc, edge_cost=edge_cost)
+    plan = SweepPlan(*args, edge_cost=edge_cost, budget=budget)
+    best = plan
+    candidates = internal_nodes(tree) if isinstance(tree, tuple) else []
+    while plan.peak_bytes > budget and len(plan.recompute) < len(candidates):
+        trials = [SweepPlan(*args, edge_cost=edge_cost, budget=budget,
+                            recompute=plan.recompute | {node})
+                  for node in candidates if node not in plan.recompute]
+        plan = min(trials, key=lambda p: (p.peak_bytes, p.flops))
+        if (plan.peak_bytes, plan.flops) < (best.peak_bytes, best.flops):
+            best = plan
+    return best
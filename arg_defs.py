@@ -85,6 +85,7 @@ def add_general_arguments(parser):
         metavar='string',
         choices=[
             'DT',
+            'MSDT',
             'DTLR',
             'PP',
             'partialPP',
@@ -92,7 +93,7 @@ def add_general_arguments(parser):
             'NLSALS',
             'SNLS'
             ],
-        help='choose the optimization method: DT, PP, partialPP, DTLR (default: DT)')
+        help='choose the optimization method: DT, MSDT, PP, partialPP, DTLR (default: DT)')
     parser.add_argument(
         '--decomposition',
         default="CP",
@@ -161,6 +162,12 @@ def add_general_arguments(parser):
         type=int,
         metavar='int',
         help='residual calculation frequency (default: 1).')
+    parser.add_argument(
+        '--res-ref-freq',
+        default=0,
+        type=int,
+        metavar='int',
+        help='check every this many Gram identity residuals against the explicit residual, 0 never checks. Apart from these checks the explicit residual only replaces the Gram identity once the squared residual is within roundoff of it, about 100 machine epsilons times the squared norm of the tensor (default: 0).')
     parser.add_argument(
         '--save-tensor',
         action='store_true',
@@ -181,6 +188,97 @@ def add_pp_arguments(parser):
         type=float,
         metavar='float',
         help='used in pairwise perturbation optimizer, tolerance for dimention tree restart')
+    parser.add_argument(
+        '--pp-threads',
+        default=1,
+        type=int,
+        metavar='int',
+        help='number of threads contracting independent nodes of the pairwise perturbation tree at initialization (default: 1)')
+    parser.add_argument(
+        '--pp-triplets',
+        default=0,
+        type=int,
+        metavar='int',
+        help='keep the triplet operators of the pairwise perturbation tree and add the largest second order corrections to every PP step while they are cheaper than a dimension tree restart (default: 0)')
+    parser.add_argument(
+        '--pp-adaptive',
+        default=0,
+        type=int,
+        metavar='int',
+        help='adapt the restart tolerance online to the fitness gained per second by DT and PP sweeps, starting from --tol-restart-dt (default: 0)')
+    parser.add_argument(
+        '--pp-budget',
+        default=0,
+        type=float,
+        metavar='float',
+        help='memory budget in MB of the pairwise perturbation tree, which falls back to dimension tree sweeps if it does not fit, 0 for no limit (default: 0)')
+    parser.add_argument(
+        '--pp-dtype',
+        default="float64",
+        metavar='string',
+        choices=[
+            'float64',
+            'float32',
+            ],
+        help='storage dtype of the pairwise perturbation operators, numpy only (default: float64)')
+    parser.add_argument(
+        '--pp-spill-dir',
+        default="",
+        metavar='string',
+        help='directory to spill pairwise perturbation operators over the budget to as memory-mapped files, numpy only, empty to disable (default: "")')
+
+def add_dt_arguments(parser):
+    parser.add_argument(
+        '--tree-shape',
+        default="left",
+        metavar='string',
+        choices=[
+            'left',
+            'balanced',
+            'optimal',
+            ],
+        help='shape of the dimension tree: left (left-deep), balanced, or optimal (minimum flops for the tensor shape and rank) (default: left)')
+    parser.add_argument(
+        '--mode-order',
+        default="index",
+        metavar='string',
+        choices=[
+            'index',
+            'size',
+            ],
+        help='order of the dimension tree modes: index, or size (update small modes first and contract large modes first) (default: index)')
+    parser.add_argument(
+        '--layout',
+        type=int,
+        default=0,
+        metavar='int',
+        help='transpose the input tensor once so the first contractions of each sweep are matrix products, numpy only (default: 0)')
+    parser.add_argument(
+        '--workspace-budget',
+        default=0,
+        type=float,
+        metavar='float',
+        help='memory budget in MB for the dimension tree intermediates; nodes are recomputed instead of kept to stay under it, 0 for no limit (default: 0)')
+    parser.add_argument(
+        '--num-slices',
+        type=int,
+        default=1,
+        metavar='int',
+        help='if greater than one do sliced standard ALS with this many slices (default: 1)')
+    parser.add_argument(
+        '--line-extrapolate',
+        type=int,
+        default=0,
+        metavar='int',
+        help='every this many standard ALS sweeps, move along the change of the last sweep by an exact polynomial line search, dense tensors only, 0 to disable (default: 0)')
+
+def add_memory_arguments(parser):
+    parser.add_argument(
+        '--memory-budget',
+        default=0,
+        type=float,
+        metavar='float',
+        help='memory budget in MB; larger dense input tensors are streamed from disk in slabs (best with --mode-order size), 0 keeps everything in memory (default: 0)')
 
 def add_col_arguments(parser):
     parser.add_argument(
@@ -253,12 +351,6 @@ def add_general_arguments_3d(parser):
         default=0,
         metavar='int',
         help='decompose Poisson tensor as opposed to random (default: 0)')
-    parser.add_argument(
-        '--num-slices',
-        type=int,
-        default=1,
-        metavar='int',
-        help='if greater than one do sliced standard ALS with this many slices (default: 1)')
 
 
 def add_sparse_arguments(parser):
@@ -279,7 +371,7 @@ def add_sparse_arguments(parser):
         type=int,
         default=0,
         metavar='int',
-        help='sparse decomposition (default: 0)')
+        help='sparse decomposition, not supported by the PP and partialPP methods or by Tucker (default: 0)')
 
 def add_nls_arguments(parser):
     parser.add_argument(
@@ -390,6 +482,12 @@ def add_nls_arguments(parser):
     default=8,
     metavar='int',
     help='Max number of Armijo"s line search iterations (default: 8 )')
+    parser.add_argument(
+    '--exact-line',
+    type=int,
+    default=0,
+    metavar='int',
+    help='Take the NLS step length from an exact polynomial line search instead of Armijo"s condition, dense tensors only (default: 0 = False)')
     parser.add_argument(
         '--experiment-prefix',
         '-ep',
@@ -512,6 +610,12 @@ def add_nls_arguments(parser):
         type=int,
         metavar='int',
         help='residual calculation frequency (default: 1).')
+    parser.add_argument(
+        '--res-ref-freq',
+        default=0,
+        type=int,
+        metavar='int',
+        help='check every this many Gram identity residuals against the explicit residual, 0 never checks. Apart from these checks the explicit residual only replaces the Gram identity once the squared residual is within roundoff of it, about 100 machine epsilons times the squared norm of the tensor (default: 0).')
     parser.add_argument(
         '--save-tensor',
         action='store_true',
@@ -36,6 +36,11 @@ def TTTP(T, A):
     """
     return ctf.TTTP(T, A)
 
+def MTTKRP(T, A, idx):
+    """ Matricized Tensor Times Khatri-Rao Product, written to A[idx]
+    """
+    ctf.MTTKRP(T, A, idx)
+
 def dot_product(a,b):
     mystr = _get_num_str(a.ndim)
     einstr = mystr +"," + mystr + "->"
@@ -58,6 +63,19 @@ def tensor(shape, sp, *args):
     return ctf.tensor(shape, sp, *args)
 
 
+def is_sparse(T):
+    return T.sp
+
+
+def todense(T):
+    if not T.sp:
+        return T
+    D = ctf.zeros(T.shape, dtype=T.dtype)
+    inds = _get_num_str(T.ndim)
+    D.i(inds) << T.i(inds)
+    return D
+
+
 def list_add(list_A, list_B):
     return [A + B for (A, B) in zip(list_A, list_B)]
 
@@ -125,6 +143,12 @@ def svd_rand(A, r):
     return ctf.svd_rand(A, r)
 
 
+def eigh(A):
+    # only used on small symmetric matrices, factored locally
+    w, V = np.linalg.eigh(A.to_nparray())
+    return ctf.from_nparray(w), ctf.from_nparray(V)
+
+
 def cholesky(A):
     return ctf.cholesky(A)
 
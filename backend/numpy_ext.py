@@ -1,6 +1,70 @@
 import numpy as np
 import numpy.linalg as la
 import scipy.linalg as sla
+import collections
+import threading
+from .numpy_sparse import SparseTensor
+from . import numpy_sparse
+
+
+class EinsumPlanCache():
+    """LRU cache of einsum contraction paths.
+
+    np.einsum with optimize=True searches for a contraction path on every call.
+    The ALS and NLS drivers issue the same few contractions every sweep, so the
+    path returned by np.einsum_path is stored per (subscripts, shapes, dtypes)
+    and passed back to np.einsum. Lookups are serialized by a lock since PP
+    initialization contracts on a thread pool; the path search itself runs
+    outside of it.
+
+    Attributes:
+        maxsize (int): number of plans kept before the least recently used is evicted.
+        hits (int): number of lookups served from the cache.
+        misses (int): number of lookups that ran the path search.
+
+    """
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._plans = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def path(self, string, operands):
+        key = (string, tuple((np.shape(op), np.asarray(op).dtype.char) for op in operands))
+        with self._lock:
+            plan = self._plans.get(key)
+            if plan is not None:
+                self.hits += 1
+                self._plans.move_to_end(key)
+                return plan
+            self.misses += 1
+        plan = np.einsum_path(string, *operands, optimize=True)[0]
+        with self._lock:
+            self._plans[key] = plan
+            self._plans.move_to_end(key)
+            while len(self._plans) > self.maxsize:
+                self._plans.popitem(last=False)
+        return plan
+
+    def clear(self):
+        with self._lock:
+            self._plans.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._plans)}
+
+
+einsum_plans = EinsumPlanCache()
+
+def einsum_cache_info():
+    return einsum_plans.info()
+
+def einsum_cache_clear():
+    einsum_plans.clear()
 
 def name():
     return 'numpy'
@@ -16,13 +80,17 @@ def save_tensor_to_file(T, filename):
 
 def load_tensor_from_file(filename):
     try:
-        T = np.load(filename)
+        # mapped copy-on-write: pages are read as the kernels touch them and
+        # in-place updates stay in memory
+        T = np.load(filename, mmap_mode='c')
         print('Loaded tensor from file ', filename)
     except FileNotFoundError:
         raise FileNotFoundError('No tensor exist on: ', filename)
     return T
 
 def TTTP(T, A):
+    if isinstance(T, SparseTensor):
+        return T.TTTP(A)
     T_inds = "".join([chr(ord('a')+i) for i in range(T.ndim)])
     einstr = ""
     A2 = []
@@ -32,9 +100,12 @@ def TTTP(T, A):
             A2.append(A[i])
     einstr += T_inds + "->" + T_inds
     A2.append(T)
-    return np.einsum(einstr, *A2,optimize=True)
+    return einsum(einstr, *A2)
 
 def MTTKRP(T,A,idx):
+    if isinstance(T, SparseTensor):
+        A[idx][:] = T.MTTKRP(A, idx)
+        return
     T_inds = "".join([chr(ord('a')+i) for i in range(T.ndim)])
     einstr = ""
     A2 = []
@@ -44,7 +115,7 @@ def MTTKRP(T,A,idx):
             A2.append(A[i])
     einstr += T_inds + "->" + chr(ord('a')+idx) + chr(ord('a')+T.ndim)
     A2.append(T)
-    A[idx][:] = np.einsum(einstr, *A2,optimize=True)
+    A[idx][:] = einsum(einstr, *A2)
 
 def is_master_proc():
     return True
@@ -53,8 +124,19 @@ def printf(*string):
     print(string)
 
 def tensor(shape, sp, *args2):
+    # matrices are always dense, e.g. the outputs of MTTKRP
+    if sp and len(shape) > 2:
+        return SparseTensor(shape)
     return np.ndarray(shape, *args2)
 
+def is_sparse(T):
+    return isinstance(T, SparseTensor)
+
+def todense(T):
+    if isinstance(T, SparseTensor):
+        return T.todense()
+    return T
+
 
 def list_add(list_A,list_B):
     return [A+B for (A,B) in zip(list_A,list_B)]
@@ -65,7 +147,7 @@ def scalar_mul(sclr,list_A):
 def mult_lists(list_A,list_B):
     s = 0
     for i in range(len(list_A)):
-        s+= np.einsum('ij,ij->',list_A[i],list_B[i],optimize=True)
+        s+= einsum('ij,ij->',list_A[i],list_B[i])
     return s
 
 def list_vecnormsq(list_A):
@@ -92,12 +174,11 @@ def scl_list_add(scl,list_A,list_B):
     
 
 def sparse_random(shape, begin, end, sp_frac):
-    tensor = np.random.random(shape)*(end-begin) + begin
-    mask = np.random.random(shape)<sp_frac
-    tensor = tensor * mask
-    return tensor
+    return numpy_sparse.sparse_random(shape, begin, end, sp_frac)
 
 def vecnorm(T):
+    if isinstance(T, SparseTensor):
+        return T.norm()
     return la.norm(np.ravel(T))
 
 def norm(v):
@@ -112,6 +193,9 @@ def eigvalh(A):
 def eigvalsh(A):
     return la.eigvalsh(A)
 
+def eigh(A):
+    return la.eigh(A)
+
 def svd(A,r=None):
     U,s,VT = la.svd(A,full_matrices=False)
     if r is not None:
@@ -140,7 +224,7 @@ def solve_tri(A, B, lower=True, from_left=True, transp_L=False):
         return sla.solve_triangular(A, B, trans=transp_L,lower=lower)
 
 def einsum(string, *args):
-    out = np.einsum(string, *args,optimize=True)
+    out = np.einsum(string, *args,optimize=einsum_plans.path(string, args))
     return out
 
 def ones(shape):
@@ -200,7 +284,7 @@ def einsvd(operand, tns, r=None, transpose=True, compute_uv=True, full_matrices=
     tgt_idx = set(tgta).union(set(tgtb))
     contract_idx = str(list(tgt_idx.difference(set(src)))[0])
     new_idx = (tgta + tgtb).replace(contract_idx, '')
-    trsped = np.einsum(src + '->' + new_idx, tns,optimize=True)
+    trsped = einsum(src + '->' + new_idx, tns)
 
     # do svd
     shape = tns.shape
@@ -240,8 +324,8 @@ def einsvd(operand, tns, r=None, transpose=True, compute_uv=True, full_matrices=
     # transpose u and vh into tgta and tgtb
     preA = tgta.replace(contract_idx, '') + contract_idx
     preB = contract_idx + tgtb.replace(contract_idx, '')
-    u = np.einsum(preA + '->' + tgta, u,optimize=True)
-    vh = np.einsum(preB + '->' + tgtb, vh,optimize=True)
+    u = einsum(preA + '->' + tgta, u)
+    vh = einsum(preB + '->' + tgtb, vh)
 
     # return
     if not transpose:
@@ -0,0 +1,199 @@
+import numpy as np
+
+
+class SparseTensor():
+    """Sparse tensor of the numpy backend in coordinate (COO) format.
+
+    The nonzeros are stored as one index array per mode and a value array.
+    MTTKRP uses a compressed sparse fiber (CSF) view of the coordinates that is
+    built once per mode and shared by every tensor with the same nonzero
+    pattern, e.g. T = TTTP(O, A) and TTTP(O, B). Kernels process the nonzeros in
+    chunks, so memory stays proportional to the number of nonzeros however large
+    the logical tensor is.
+
+    Attributes:
+        shape (tuple): logical shape.
+        inds (ndarray): order x nnz coordinates of the nonzeros.
+        vals (ndarray): values of the nonzeros.
+        chunk (int): number of nonzeros a kernel processes at once.
+
+    """
+    chunk = 1 << 20
+
+    def __init__(self, shape, inds=None, vals=None, dtype=np.float64):
+        self.shape = tuple(int(s) for s in shape)
+        if inds is None:
+            inds = np.zeros((len(self.shape), 0), dtype=np.int64)
+            vals = np.zeros(0, dtype=dtype)
+        self.inds = inds
+        self.vals = vals
+        # CSF views by root mode, shared with the tensors of the same pattern
+        self._csf = {}
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def nnz(self):
+        return self.vals.shape[0]
+
+    @property
+    def dtype(self):
+        return self.vals.dtype
+
+    def with_values(self, vals):
+        """Sparse tensor with the nonzero pattern of this one and values vals.
+        """
+        T = SparseTensor(self.shape, self.inds, vals)
+        T._csf = self._csf
+        return T
+
+    def same_pattern(self, other):
+        return self.inds is other.inds or (self.shape == other.shape and
+                                           np.array_equal(self.inds, other.inds))
+
+    def _check_pattern(self, other):
+        if not self.same_pattern(other):
+            raise ValueError('Sparse tensors with different nonzero patterns are not supported')
+
+    def __add__(self, other):
+        self._check_pattern(other)
+        return self.with_values(self.vals + other.vals)
+
+    def __sub__(self, other):
+        self._check_pattern(other)
+        return self.with_values(self.vals - other.vals)
+
+    def __neg__(self):
+        return self.with_values(-self.vals)
+
+    def __mul__(self, scl):
+        return self.with_values(self.vals * scl)
+
+    __rmul__ = __mul__
+
+    def norm(self):
+        return np.linalg.norm(self.vals)
+
+    def todense(self):
+        T = np.zeros(self.shape, dtype=self.dtype)
+        T[tuple(self.inds)] = self.vals
+        return T
+
+    def _chunks(self):
+        for start in range(0, self.nnz, self.chunk):
+            yield start, min(start + self.chunk, self.nnz)
+
+    def TTTP(self, A):
+        """Values of the CP tensor of the factors A on the nonzero pattern, times
+        the values of this tensor. Factors that are None are skipped.
+        """
+        vals = self.vals.copy()
+        A = [(m, A[m]) for m in range(self.ndim) if A[m] is not None]
+        if len(A) == 0:
+            return self.with_values(vals)
+        for e0, e1 in self._chunks():
+            P = None
+            for m, Am in A:
+                if P is None:
+                    P = Am[self.inds[m, e0:e1]]
+                else:
+                    P *= Am[self.inds[m, e0:e1]]
+            vals[e0:e1] *= P.sum(axis=1)
+        return self.with_values(vals)
+
+    def csf(self, mode):
+        if mode not in self._csf:
+            self._csf[mode] = _CSF(self.inds, self.shape, mode, self.chunk)
+        return self._csf[mode]
+
+    def MTTKRP(self, A, mode):
+        """Matricized tensor times Khatri-Rao product of the factors A of every
+        mode but mode.
+        """
+        R = A[(mode + 1) % self.ndim].shape[1]
+        dtype = np.result_type(self.dtype, A[(mode + 1) % self.ndim].dtype)
+        out = np.zeros((self.shape[mode], R), dtype=dtype)
+        if self.ndim == 1:
+            out[self.inds[0], :] = self.vals[:, None]
+            return out
+        c = self.csf(mode)
+        vals = self.vals[c.perm]
+        for f0, f1 in c.fiber_chunks:
+            e0, e1 = c.fiber_ptr[f0], c.fiber_ptr[f1]
+            # sum each fiber over the leaf mode, then scale by the upper levels
+            W = vals[e0:e1, None] * A[c.leaf][c.leaf_inds[e0:e1]]
+            F = np.add.reduceat(W, c.fiber_ptr[f0:f1] - e0, axis=0)
+            for m in c.mid:
+                F *= A[m][c.fiber_inds[m][f0:f1]]
+            roots = c.fiber_inds[mode][f0:f1]
+            starts = np.flatnonzero(np.concatenate(([True], roots[1:] != roots[:-1])))
+            out[roots[starts]] += np.add.reduceat(F, starts, axis=0)
+        return out
+
+
+class _CSF():
+    """Compressed sparse fiber view of a coordinate pattern rooted at one mode.
+
+    The nonzeros are sorted by the root mode, then by the intermediate modes,
+    then by the leaf mode. A fiber is a run of nonzeros that only differ in the
+    leaf index.
+
+    Attributes:
+        perm (ndarray): sorting permutation of the nonzeros.
+        leaf (int): leaf mode, the largest mode other than the root.
+        mid (list): modes between the root and the leaf.
+        leaf_inds (ndarray): sorted leaf indices of the nonzeros.
+        fiber_ptr (ndarray): start of every fiber in the sorted nonzeros, followed
+            by nnz.
+        fiber_inds (dict): root and intermediate indices of every fiber by mode.
+        fiber_chunks (list): ranges of fibers holding about chunk nonzeros each.
+
+    """
+    def __init__(self, inds, shape, mode, chunk):
+        order = len(shape)
+        others = [m for m in range(order) if m != mode]
+        self.leaf = max(others, key=lambda m: shape[m])
+        self.mid = [m for m in others if m != self.leaf]
+        levels = [mode] + self.mid
+        # lexsort sorts by its last key first
+        self.perm = np.lexsort([inds[self.leaf]] + [inds[m] for m in reversed(levels)])
+        nnz = self.perm.shape[0]
+        self.leaf_inds = inds[self.leaf][self.perm]
+        sorted_levels = [inds[m][self.perm] for m in levels]
+        new_fiber = np.zeros(nnz, dtype=bool)
+        if nnz > 0:
+            new_fiber[0] = True
+        for ind in sorted_levels:
+            new_fiber[1:] |= ind[1:] != ind[:-1]
+        starts = np.flatnonzero(new_fiber)
+        self.fiber_ptr = np.append(starts, nnz)
+        self.fiber_inds = {}
+        for m, ind in zip(levels, sorted_levels):
+            self.fiber_inds[m] = ind[starts]
+        self.fiber_chunks = []
+        nfib = starts.shape[0]
+        f0 = 0
+        while f0 < nfib:
+            f1 = int(np.searchsorted(self.fiber_ptr, self.fiber_ptr[f0] + chunk, side='right')) - 1
+            f1 = min(max(f1, f0 + 1), nfib)
+            self.fiber_chunks.append((f0, f1))
+            f0 = f1
+
+
+def sparse_random(shape, begin, end, sp_frac):
+    """Sparse tensor whose entries are nonzero with probability sp_frac and then
+    uniform in [begin, end). The coordinates are sampled without forming the
+    dense tensor.
+    """
+    shape = tuple(int(s) for s in shape)
+    size = int(np.prod(shape, dtype=np.float64))
+    nnz = np.random.binomial(size, sp_frac)
+    lin = np.zeros(0, dtype=np.int64)
+    while lin.shape[0] < nnz:
+        draw = np.random.randint(0, size, size=nnz - lin.shape[0], dtype=np.int64)
+        lin = np.unique(np.concatenate((lin, draw)))
+    inds = np.array(np.unravel_index(lin, shape), dtype=np.int64).reshape(len(shape), -1)
+    vals = np.random.random(nnz) * (end - begin) + begin
+    return SparseTensor(shape, inds, vals)
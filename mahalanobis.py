@@ -13,7 +13,8 @@ import arg_defs as arg_defs
 import csv
 import numpy.linalg as la
 
-from CPD.common_kernels import get_residual,get_residual_sp,equilibrate,solve_sys,normalise
+from CPD.common_kernels import equilibrate,solve_sys,normalise
+from CPD.residual import CP_ResidualEngine
 
 from utils import save_decomposition_results
 
@@ -129,7 +130,8 @@ def CP_Mahalanobis(tenpy,A,T,O,num_iter,thresh,csv_file=None,Regu=None,args=None
 	
 	
 	time_all = 0.
-	normT = tenpy.vecnorm(T)
+	res_engine = CP_ResidualEngine(tenpy,T,O,args.sp,args.res_ref_freq)
+	normT = res_engine.normT
 	method = "M-norm"
 	fitness_old = 1
 	prev_res = np.finfo(np.float32).max
@@ -146,10 +148,7 @@ def CP_Mahalanobis(tenpy,A,T,O,num_iter,thresh,csv_file=None,Regu=None,args=None
 
 	for k in range(1,num_iter):
 		if k % res_calc_freq == 0 or k==num_iter-1 :
-			if args.sp:
-				res = get_residual_sp(tenpy,O,T,A)
-			else:
-				res = get_residual(tenpy,T,A)
+			res = res_engine.get_residual(A)
 
 			fitness = 1-res/normT
 
@@ -311,6 +310,10 @@ if __name__ == "__main__":
 
 	tenpy.printf("The shape of the input tensor is: ", T.shape)
 
+	if not args.sp:
+		# the dense optimizers contract T directly
+		T = tenpy.todense(T)
+
 	Regu = args.regularization
 
 	A = []
@@ -29,8 +29,9 @@ def CP_ALS(tenpy,
            res_calc_freq=1,
            tol=1e-05):
 
-    from CPD.common_kernels import get_residual
-    from CPD.standard_ALS import CP_DTALS_Optimizer, CP_PPALS_Optimizer
+    from CPD.residual import CP_ResidualEngine
+    from CPD.standard_ALS import CP_DTALS_Optimizer, CP_PPALS_Optimizer, CP_MSDTALS_Optimizer, \
+        CP_DTLRALS_Optimizer, CP_SlicedALS_Optimizer, CP_partialPPALS_Optimizer
 
     flag_dt = True
 
@@ -43,40 +44,47 @@ def CP_ALS(tenpy,
     if Regu is None:
         Regu = 0
 
-    normT = tenpy.vecnorm(T)
+    res_engine = CP_ResidualEngine(tenpy, T, O, args.sp, args.res_ref_freq,
+                                    memory_budget=getattr(args, 'memory_budget', 0))
+    normT = res_engine.normT
 
     time_all = 0.
     if args is None:
         optimizer = CP_DTALS_Optimizer(tenpy, T, A,args)
     else:
+        if method == 'DT' and getattr(args, 'run_lowrank_dt', 0):
+            method = 'DTLR'
         optimizer_list = {
-            'DT': CP_DTALS_Optimizer(tenpy, T, A,args),
-            'PP': CP_PPALS_Optimizer(tenpy, T, A, args),
+            'DT': CP_SlicedALS_Optimizer if getattr(args, 'num_slices', 1) > 1 else CP_DTALS_Optimizer,
+            'PP': CP_PPALS_Optimizer,
+            'partialPP': CP_partialPPALS_Optimizer,
+            'MSDT': CP_MSDTALS_Optimizer,
+            'DTLR': CP_DTLRALS_Optimizer,
         }
-        optimizer = optimizer_list[method]
+        optimizer = optimizer_list[method](tenpy, T, A, args)
 
     fitness_old = 0
     for i in range(num_iter):
 
         if i % res_calc_freq == 0 or i == num_iter - 1 or not flag_dt:
-            if args.sp:
-                res = get_residual_sp(tenpy,O,T,A)
-            else:
-                res = get_residual(tenpy, T, A)
+            res = res_engine.get_residual(A, optimizer.mttkrp, optimizer.gram)
             fitness = 1 - res / normT
+            if method in ('PP', 'partialPP'):
+                optimizer.record_fitness(fitness)
 
             if tenpy.is_master_proc():
                 print("[", i, "] Residual is", res, "fitness is: ", fitness)
                 # write to csv file
                 if csv_file is not None:
-                    csv_writer.writerow([i, time_all, res, fitness, flag_dt])
+                    csv_writer.writerow([i, time_all, res, fitness, flag_dt,
+                                         getattr(optimizer, 'pp_decision', '')])
                     csv_file.flush()
 
         if res < tol:
             print('Method converged in', i, 'iterations')
             break
         t0 = time.time()
-        if method == 'PP':
+        if method in ('PP', 'partialPP'):
             A, pp_restart = optimizer.step(Regu)
             flag_dt = not pp_restart
         else:
@@ -88,6 +96,8 @@ def CP_ALS(tenpy,
         fitness_old = fitness
 
     tenpy.printf(method + " method took", time_all, "seconds overall")
+    optimizer.close()
+    res_engine.close()
 
     if args.save_tensor:
         folderpath = join(results_dir, arg_defs.get_file_prefix(args))
@@ -120,10 +130,10 @@ def Tucker_ALS(tenpy,
 
     time_all = 0.
     optimizer_list = {
-        'DT': Tucker_DTALS_Optimizer(tenpy, T, A),
-        'PP': Tucker_PPALS_Optimizer(tenpy, T, A, args),
+        'DT': Tucker_DTALS_Optimizer,
+        'PP': Tucker_PPALS_Optimizer,
     }
-    optimizer = optimizer_list[method]
+    optimizer = optimizer_list[method](tenpy, T, A, args)
 
     normT = tenpy.vecnorm(T)
 
@@ -131,12 +141,15 @@ def Tucker_ALS(tenpy,
         if i % res_calc_freq == 0 or i == num_iter - 1 or not flag_dt:
             res = get_residual(tenpy, T, optimizer.A)
             fitness = 1 - res / normT
+            if method == 'PP':
+                optimizer.record_fitness(fitness)
 
             if tenpy.is_master_proc():
                 print("[", i, "] Residual is", res, "fitness is: ", fitness)
                 # write to csv file
                 if csv_file is not None:
-                    csv_writer.writerow([i, time_all, res, fitness, flag_dt])
+                    csv_writer.writerow([i, time_all, res, fitness, flag_dt,
+                                         getattr(optimizer, 'pp_decision', '')])
                     csv_file.flush()
         t0 = time.time()
         if method == 'PP':
@@ -148,6 +161,7 @@ def Tucker_ALS(tenpy,
         tenpy.printf("Sweep took", t1 - t0, "seconds")
         time_all += t1 - t0
     tenpy.printf("Naive method took", time_all, "seconds overall")
+    optimizer.close()
 
     if args.save_tensor:
         folderpath = join(results_dir, arg_defs.get_file_prefix(args))
@@ -162,8 +176,15 @@ if __name__ == "__main__":
     arg_defs.add_general_arguments(parser)
     arg_defs.add_sparse_arguments(parser)
     arg_defs.add_pp_arguments(parser)
+    arg_defs.add_dt_arguments(parser)
+    arg_defs.add_lrdt_arguments(parser)
     arg_defs.add_col_arguments(parser)
+    arg_defs.add_memory_arguments(parser)
     args, _ = parser.parse_known_args()
+    if args.sp and args.decomposition == "Tucker":
+        parser.error("--sp is not supported with --decomposition Tucker")
+    if args.sp and args.method in ('PP', 'partialPP'):
+        parser.error("--sp is not supported with --method " + args.method)
 
     # Set up CSV logging
     csv_path = join(results_dir, arg_defs.get_file_prefix(args) + '.csv')
@@ -199,7 +220,7 @@ if __name__ == "__main__":
         # initialize the csv file
         if is_new_log:
             csv_writer.writerow(
-                ['iterations', 'time', 'residual', 'fitness', 'dt_step'])
+                ['iterations', 'time', 'residual', 'fitness', 'dt_step', 'pp_control'])
 
     tenpy.seed(args.seed)
 
@@ -240,6 +261,10 @@ if __name__ == "__main__":
 
     tenpy.printf("The shape of the input tensor is: ", T.shape)
 
+    if not args.sp:
+        # the dense optimizers contract T directly
+        T = tenpy.todense(T)
+
     Regu = args.regularization
 
     A = []
@@ -261,7 +286,7 @@ if __name__ == "__main__":
                 A.append(tenpy.random((T.shape[i], R)))
         else:
             for i in range(T.ndim):
-                A.append(tenpy.random((T.shape[i], args, hosvd_core_dim[i])))
+                A.append(tenpy.random((T.shape[i], args.hosvd_core_dim[i])))
 
     if args.decomposition == "CP":
         if args.hosvd:
@@ -19,7 +19,7 @@ results_dir = join(parent_dir, 'results')
 
 def CP_NLS(tenpy,A,T,O,num_iter,csv_file=None,Regu=None,method='NLS',args=None,res_calc_freq=1):
 
-    from CPD.common_kernels import get_residual,get_residual_sp
+    from CPD.residual import CP_ResidualEngine
     from CPD.NLS import CP_fastNLS_Optimizer
 
 
@@ -37,7 +37,9 @@ def CP_NLS(tenpy,A,T,O,num_iter,csv_file=None,Regu=None,method='NLS',args=None,r
     iters = 0
     count = 0
 
-    normT = tenpy.vecnorm(T)
+    res_engine = CP_ResidualEngine(tenpy,T,O,args.sp,args.res_ref_freq,
+                                   memory_budget=getattr(args, 'memory_budget', 0))
+    normT = res_engine.normT
     
     if args.maxiter == 0:
         args.maxiter = sum(T.shape)*R
@@ -45,10 +47,10 @@ def CP_NLS(tenpy,A,T,O,num_iter,csv_file=None,Regu=None,method='NLS',args=None,r
     time_all = 0.
     if method == 'DT':
         method = 'NLS'
-        optimizer = CP_fastNLS_Optimizer(tenpy,T,A,args)
+        optimizer = CP_fastNLS_Optimizer(tenpy,T,A,args,O)
     else:
         optimizer_list = {
-            'NLS': CP_fastNLS_Optimizer(tenpy,T,A,args)
+            'NLS': CP_fastNLS_Optimizer(tenpy,T,A,args,O)
         }
         optimizer = optimizer_list[method]
 
@@ -57,10 +59,7 @@ def CP_NLS(tenpy,A,T,O,num_iter,csv_file=None,Regu=None,method='NLS',args=None,r
     for i in range(num_iter):
 
         if i % res_calc_freq == 0 or i==num_iter-1 :
-            if args.sp:
-                res = get_residual_sp(tenpy,O,T,A)
-            else:
-                res = get_residual(tenpy,T,A)
+            res = res_engine.get_residual(A)
             fitness = 1-res/normT
 
             if tenpy.is_master_proc():
@@ -120,6 +119,8 @@ def CP_NLS(tenpy,A,T,O,num_iter,csv_file=None,Regu=None,method='NLS',args=None,r
         
     
     tenpy.printf(method+" method took",time_all,"seconds overall")
+    optimizer.close()
+    res_engine.close()
     
     
 
@@ -139,6 +140,7 @@ if __name__ == "__main__":
     arg_defs.add_sparse_arguments(parser)
     arg_defs.add_nls_arguments(parser)
     arg_defs.add_col_arguments(parser)
+    arg_defs.add_memory_arguments(parser)
     args, _ = parser.parse_known_args()
 
     # Set up CSV logging
@@ -233,6 +235,10 @@ if __name__ == "__main__":
         
     tenpy.printf("The shape of the input tensor is: ", T.shape)
 
+    if not args.sp:
+        # the dense optimizers contract T directly
+        T = tenpy.todense(T)
+
     Regu = args.regularization
 
     A = []
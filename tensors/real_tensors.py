@@ -2,7 +2,7 @@ import numpy as np
 import os
 from os.path import dirname, join
 from scipy.io import loadmat
-from .utils import download_unzip_data, load_images_from_folder
+from .utils import download_unzip_data, load_images_from_folder, memmap_tensor
 
 
 def amino_acids(tenpy):
@@ -76,8 +76,7 @@ def coil_100(tenpy):
 
     if not os.path.isfile(join(data_dir, 'coil-100.bin')):
         create_bin()
-    pixels = np.fromfile(join(data_dir, 'coil-100.bin'), dtype=float).reshape(
-        (7200, 128, 128, 3))
+    pixels = memmap_tensor(join(data_dir, 'coil-100.bin'), (7200, 128, 128, 3))
 
     if tenpy.name() == 'ctf':
         return tenpy.from_nparray(pixels)
@@ -144,8 +143,7 @@ def time_lapse_images(tenpy):
 
     if not os.path.isfile(join(data_dir, 'time-lapse.bin')):
         create_bin()
-    pixels = np.fromfile(join(data_dir, 'time-lapse.bin'),
-                         dtype=float).reshape((9, 1024, 1344, 33))
+    pixels = memmap_tensor(join(data_dir, 'time-lapse.bin'), (9, 1024, 1344, 33))
 
     if tenpy.name() == 'ctf':
         return tenpy.from_nparray(pixels)
@@ -32,3 +32,38 @@ def load_images_from_folder(folder):
             pix_val.append(pix)
         img.close()
     return np.asarray(pix_val)
+
+
+def memmap_tensor(file_name, shape, dtype=float):
+    """Map a raw binary tensor file read-only instead of reading it into memory.
+
+    The returned np.memmap is an ndarray, so every numpy kernel accepts it, but
+    pages of the file are only read, and only stay resident, as the kernels
+    touch them.
+    """
+    return np.memmap(file_name, dtype=dtype, mode='r', shape=tuple(shape))
+
+
+def slab_size(shape, axis, itemsize, budget):
+    """Number of indices of axis in the largest slab of a tensor of shape that
+    fits in budget bytes, at least 1.
+    """
+    slice_bytes = itemsize
+    for j in range(len(shape)):
+        if j != axis:
+            slice_bytes *= shape[j]
+    return int(max(1, min(shape[axis], budget // slice_bytes)))
+
+
+def slabs(T, axis, size):
+    """Iterate over the slabs of T along axis holding size indices each.
+
+    Yields:
+        (start, stop, view) where view is T[..., start:stop, ...]. Views of a
+        memory-mapped tensor are not read from disk until they are used.
+    """
+    for start in range(0, T.shape[axis], size):
+        stop = min(start + size, T.shape[axis])
+        index = [slice(None)] * T.ndim
+        index[axis] = slice(start, stop)
+        yield start, stop, T[tuple(index)]
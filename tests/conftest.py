@@ -0,0 +1,69 @@
+import argparse
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import arg_defs
+import backend.numpy_ext as numpy_ext
+
+
+@pytest.fixture
+def tenpy():
+    return numpy_ext
+
+
+@pytest.fixture
+def make_args():
+    """Driver defaults of run_als.py with the given overrides."""
+    def make(**kwargs):
+        parser = argparse.ArgumentParser()
+        arg_defs.add_general_arguments(parser)
+        arg_defs.add_sparse_arguments(parser)
+        arg_defs.add_pp_arguments(parser)
+        arg_defs.add_dt_arguments(parser)
+        arg_defs.add_lrdt_arguments(parser)
+        arg_defs.add_memory_arguments(parser)
+        args = parser.parse_args([])
+        args.tlib = 'numpy'
+        for key, value in kwargs.items():
+            setattr(args, key, value)
+        return args
+    return make
+
+
+@pytest.fixture
+def make_nls_args():
+    """Driver defaults of run_nls.py with the given overrides."""
+    def make(**kwargs):
+        parser = argparse.ArgumentParser()
+        arg_defs.add_pp_arguments(parser)
+        arg_defs.add_lrdt_arguments(parser)
+        arg_defs.add_sparse_arguments(parser)
+        arg_defs.add_nls_arguments(parser)
+        arg_defs.add_col_arguments(parser)
+        arg_defs.add_memory_arguments(parser)
+        args = parser.parse_args([])
+        args.tlib = 'numpy'
+        for key, value in kwargs.items():
+            setattr(args, key, value)
+        return args
+    return make
+
+
+@pytest.fixture
+def cp_problem():
+    """Noisy low-rank dense tensor with modes of different sizes and a random
+    initial guess."""
+    def make(shape=(9, 5, 7, 6), R=3, noise=1e-2, seed=0):
+        rng = np.random.RandomState(seed)
+        factors = [rng.random_sample((s, R)) for s in shape]
+        T = np.einsum('ir,jr,kr,lr->ijkl', *factors) if len(shape) == 4 else \
+            np.einsum('ir,jr,kr->ijk', *factors)
+        T = T + noise * rng.standard_normal(T.shape)
+        A = [rng.random_sample((s, R)) for s in shape]
+        return T, A
+    return make
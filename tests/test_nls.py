@@ -0,0 +1,45 @@
+import numpy as np
+
+from CPD.common_kernels import get_residual
+from CPD.NLS import CP_fastNLS_Optimizer
+from tensors.synthetic_tensors import init_rand
+
+
+def test_sparse_armijo_step(tenpy, make_nls_args):
+    T, O = init_rand(tenpy, 3, 8, 3, 0.3, 1)
+    rng = np.random.RandomState(0)
+    A = [rng.random_sample((8, 3)) for _ in range(3)]
+    dense = [a.copy() for a in A]
+    args = make_nls_args(sp=1, arm=1, maxiter=100)
+    optimizer = CP_fastNLS_Optimizer(tenpy, T, A, args, O)
+    A, _ = optimizer.step(1e-3)
+    optimizer.close()
+    # the same step on the dense tensor with the zeros made explicit
+    args = make_nls_args(arm=1, maxiter=100)
+    optimizer = CP_fastNLS_Optimizer(tenpy, T.todense(), dense, args)
+    dense, _ = optimizer.step(1e-3)
+    optimizer.close()
+    for X, Y in zip(A, dense):
+        assert np.allclose(X, Y, rtol=1e-8, atol=1e-10)
+    assert get_residual(tenpy, T.todense(), A) < tenpy.vecnorm(T)
+
+
+def test_armijo_streams_under_memory_budget(tenpy, make_nls_args, cp_problem, monkeypatch):
+    T, A = cp_problem()
+    args = make_nls_args(arm=1, maxiter=100)
+    optimizer = CP_fastNLS_Optimizer(tenpy, T, [a.copy() for a in A], args)
+    in_memory, _ = optimizer.step(1e-3)
+    optimizer.close()
+
+    def full_reconstruction(*args):
+        raise AssertionError('the residual reconstructed the whole tensor')
+    monkeypatch.setattr('CPD.residual.get_residual', full_reconstruction)
+    args = make_nls_args(arm=1, maxiter=100, memory_budget=T.nbytes / 3. / 2**20)
+    optimizer = CP_fastNLS_Optimizer(tenpy, T, [a.copy() for a in A], args)
+    assert optimizer.res_engine.slabs is optimizer.slabs
+    streamed, _ = optimizer.step(1e-3)
+    # one pass for the gradient and at least two for the Armijo residuals
+    assert optimizer.slabs.num_passes >= 3
+    optimizer.close()
+    for X, Y in zip(in_memory, streamed):
+        assert np.allclose(X, Y, rtol=1e-8, atol=1e-10)
@@ -0,0 +1,197 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from backend.numpy_ext import EinsumPlanCache
+from CPD.common_kernels import compute_mttkrp
+from CPD.gram_cache import GramCache
+from CPD.hessian import CP_HessianEngine
+from CPD.NLS import CGWorkspace, CP_fastNLS_Optimizer
+
+
+def test_einsum_plan_cache_is_thread_safe():
+    cache = EinsumPlanCache(maxsize=4)
+    operands = [[np.ones((n, 3)), np.ones((3, n + 1))] for n in range(1, 17)]
+
+    def lookups(k):
+        for _ in range(50):
+            for ops in operands[k::2]:
+                cache.path('ij,jk->ik', ops)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lookups, [0, 1] * 4))
+    info = cache.info()
+    assert info['size'] == 4
+    assert info['hits'] + info['misses'] == 8 * 50 * 8
+
+
+def test_einsum_plan_cache_counts_and_evicts():
+    cache = EinsumPlanCache(maxsize=2)
+    A, B, C = np.ones((2, 3)), np.ones((3, 4)), np.ones((4, 5))
+    cache.path('ij,jk->ik', [A, B])
+    cache.path('ij,jk->ik', [A, B])
+    assert cache.info() == {'hits': 1, 'misses': 1, 'size': 1}
+    # same subscripts on other shapes or dtypes are other plans
+    cache.path('ij,jk->ik', [B, C])
+    cache.path('ij,jk->ik', [A.astype(np.float32), B])
+    assert cache.info() == {'hits': 1, 'misses': 3, 'size': 2}
+    # the least recently used plan of A, B was evicted
+    cache.path('ij,jk->ik', [A, B])
+    assert cache.info() == {'hits': 1, 'misses': 4, 'size': 2}
+    cache.clear()
+    assert cache.info() == {'hits': 0, 'misses': 0, 'size': 0}
+
+
+def test_einsum_uses_cached_plans(tenpy):
+    tenpy.einsum_cache_clear()
+    A, B = np.random.random((4, 3)), np.random.random((3, 5))
+    for _ in range(3):
+        assert np.allclose(tenpy.einsum('ij,jk->ik', A, B), A.dot(B))
+    info = tenpy.einsum_cache_info()
+    assert info['misses'] == 1 and info['hits'] == 2
+
+
+def _sparse_problem(tenpy, shape, chunk, seed=0):
+    np.random.seed(seed)
+    T = tenpy.sparse_random(shape, -1., 1., 0.3)
+    # small chunks so that the kernels cross chunk boundaries
+    T.chunk = chunk
+    A = [np.random.random((s, 3)) for s in shape]
+    return T, A
+
+
+@pytest.mark.parametrize('shape', [(6, 7, 8), (5, 4, 6, 3)])
+@pytest.mark.parametrize('chunk', [7, 1 << 20])
+def test_sparse_mttkrp_matches_dense(tenpy, shape, chunk):
+    T, A = _sparse_problem(tenpy, shape, chunk)
+    dense = T.todense()
+    for i in range(len(shape)):
+        lst = list(A)
+        lst[i] = np.zeros(A[i].shape)
+        tenpy.MTTKRP(T, lst, i)
+        assert np.allclose(lst[i], compute_mttkrp(tenpy, dense, A, i))
+
+
+@pytest.mark.parametrize('chunk', [7, 1 << 20])
+def test_sparse_tttp_matches_dense(tenpy, chunk):
+    T, A = _sparse_problem(tenpy, (6, 7, 8), chunk)
+    dense = T.todense()
+    assert np.allclose(tenpy.TTTP(T, A).todense(), tenpy.TTTP(dense, A))
+    skipped = [A[0], None, A[2]]
+    assert np.allclose(tenpy.TTTP(T, skipped).todense(), tenpy.TTTP(dense, skipped))
+
+
+def test_sparse_arithmetic_and_norm(tenpy):
+    T, A = _sparse_problem(tenpy, (6, 7, 8), 7)
+    K = tenpy.TTTP(T, A)
+    assert np.isclose(tenpy.vecnorm(T), np.linalg.norm(T.todense()))
+    assert np.allclose((T - K).todense(), T.todense() - K.todense())
+    assert np.allclose((T + 2. * K).todense(), T.todense() + 2. * K.todense())
+    other, _ = _sparse_problem(tenpy, (6, 7, 8), 7, seed=1)
+    with pytest.raises(ValueError):
+        T - other
+
+
+def _gamma(A):
+    grams = [a.T.dot(a) for a in A]
+    gamma = [[np.ones(grams[0].shape) for _ in A] for _ in A]
+    for n in range(len(A)):
+        for p in range(len(A)):
+            for j in range(len(A)):
+                if j != n and j != p:
+                    gamma[n][p] = gamma[n][p] * grams[j]
+    return gamma
+
+
+def _reference_hessian(tenpy, A, X, gamma, diag, regu):
+    # J^T J X with J X the sum of the CP tensors of A with one factor replaced by X
+    JX = sum(tenpy.TTTP(np.ones([a.shape[0] for a in A]), A[:n] + [X[n]] + A[n + 1:])
+             for n in range(len(A)))
+    ret = [compute_mttkrp(tenpy, JX, A, n) for n in range(len(A))]
+    for n in range(len(A)):
+        ret[n] += regu * (X[n] * np.diagonal(gamma[n][n]) if diag else X[n])
+    return ret
+
+
+@pytest.mark.parametrize('diag', [False, True])
+def test_hessian_engine_matches_reference(tenpy, diag):
+    rng = np.random.RandomState(0)
+    shape = (5, 3, 4, 6)
+    A = [rng.random_sample((s, 2)) for s in shape]
+    X = [rng.standard_normal((s, 2)) for s in shape]
+    gamma = _gamma(A)
+    H = CP_HessianEngine(tenpy, A, gamma, diag)
+    expected = _reference_hessian(tenpy, A, X, gamma, diag, 0.5)
+    out = [np.empty_like(x) for x in X]
+    H.matvec(X, 0.5, out=out)
+    stacked = H.unstack(H.matvec_batch(H.stack(X), 0.5))
+    for Y in (H.matvec(X, 0.5), out, stacked):
+        for y, e in zip(Y, expected):
+            assert np.allclose(y, e)
+
+
+def test_cg_workspace_views_share_the_flat_buffers():
+    A = [np.ones((4, 2)), np.ones((3, 2))]
+    ws = CGWorkspace(A)
+    assert ws.fits(A) and not ws.fits([np.ones((4, 2))])
+    ws.views['p'][1][...] = 2.
+    assert ws.flat['p'][8:].tolist() == [2.] * 6 and not ws.flat['p'][:8].any()
+    ws.axpy(ws.flat['p'], ws.flat['x'], a=.5)
+    assert np.all(ws.views['x'][1] == 1.) and not ws.views['x'][0].any()
+
+
+@pytest.mark.parametrize('precondition', [False, True])
+def test_flat_conjugate_gradient_solves_the_damped_system(tenpy, make_nls_args, cp_problem, precondition):
+    T, A = cp_problem()
+    optimizer = CP_fastNLS_Optimizer(tenpy, T, A, make_nls_args(cg_tol=1e-12, maxiter=500))
+    optimizer.compute_G()
+    optimizer.compute_gamma()
+    g = optimizer.gradient()
+    if precondition:
+        P = optimizer.compute_block_diag_preconditioner(1e-2)
+        x, _ = optimizer.fast_precond_conjugate_gradient(g, P, 1e-2)
+    else:
+        x, _ = optimizer.fast_conjugate_gradient(g, 1e-2)
+    for y, gn in zip(optimizer.hessian_engine().matvec(x, 1e-2), g):
+        assert np.allclose(y, gn, rtol=1e-6, atol=1e-8 * np.linalg.norm(gn))
+
+
+def test_gram_cache_gamma_matches_direct_products(tenpy):
+    rng = np.random.RandomState(3)
+    A = [rng.random_sample((s, 3)) for s in (5, 3, 4, 6, 2)]
+    cache = GramCache(tenpy, A)
+    for step in range(3):
+        gamma, expected = cache.hadamard_except_pairs(), _gamma(A)
+        for n in range(len(A)):
+            assert np.allclose(cache.hadamard_except(n), expected[n][n])
+            for p in range(len(A)):
+                assert np.allclose(gamma[n][p], expected[n][p])
+        full = expected[0][0] * A[0].T.dot(A[0])
+        assert np.allclose(cache.hadamard_all(), full)
+        # a factor updated in place and one replaced
+        A[step] += 0.1
+        cache.update(step, A[step])
+        A[step + 2] = rng.random_sample(A[step + 2].shape)
+        cache.refresh(A)
+
+
+@pytest.mark.parametrize('diag', [0, 1])
+def test_block_preconditioner_inverts_the_damped_blocks(tenpy, make_nls_args, cp_problem, diag):
+    T, A = cp_problem()
+    optimizer = CP_fastNLS_Optimizer(tenpy, T, A, make_nls_args(diag=diag))
+    optimizer.compute_G()
+    optimizer.compute_gamma()
+    for Regu in (1e-1, 1e-3):
+        P = optimizer.compute_block_diag_preconditioner(Regu)
+        for n in range(len(A)):
+            G = optimizer.gamma[n][n]
+            D = np.diag(np.diagonal(G)) if diag else np.eye(G.shape[0])
+            assert np.allclose(P[n], np.linalg.inv(G + Regu * D))
+    # the eigendecompositions are reused while gamma is unchanged
+    block_eig = optimizer.block_eig
+    optimizer.compute_block_diag_preconditioner(1.)
+    assert optimizer.block_eig is block_eig
+    optimizer.compute_gamma()
+    optimizer.compute_block_diag_preconditioner(1.)
+    assert optimizer.block_eig is not block_eig
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from CPD.common_kernels import compute_mttkrp
+from CPD.residual import CP_ResidualEngine
+from CPD.standard_ALS import CP_PPALS_Optimizer, CP_partialPPALS_Optimizer
+
+
+def test_triplet_corrections_improve_pp_mttkrp(tenpy, make_args, cp_problem):
+    T, A = cp_problem(noise=0.)
+    optimizer = CP_PPALS_Optimizer(tenpy, T, [a.copy() for a in A], make_args(pp_triplets=1))
+    optimizer._initialize_tree()
+    rng = np.random.RandomState(1)
+    for j in range(optimizer.order):
+        optimizer.dA[j] = 1e-2 * rng.standard_normal(A[j].shape)
+        optimizer.A[j] = A[j] + optimizer.dA[j]
+    optimizer._select_triplet_terms(optimizer._relative_updates())
+    assert optimizer.triplet_terms
+    for i in range(optimizer.order):
+        exact = compute_mttkrp(tenpy, T, optimizer.A, i).T
+        first_order = np.array(optimizer._pp_mttkrp(i))
+        corrected = first_order.copy()
+        for ii, j, k in optimizer.triplet_terms:
+            if ii == i:
+                corrected += optimizer._triplet_term(i, j, k)
+        first_error = np.linalg.norm(first_order - exact)
+        corrected_error = np.linalg.norm(corrected - exact)
+        assert corrected_error < 0.1 * first_error
+
+
+def _collinear_problem(shape, R, col, seed=0):
+    # exact rank R tensor whose factors have pairwise column cosines col
+    rng = np.random.RandomState(seed)
+    L = np.linalg.cholesky(np.full((R, R), col) + (1 - col) * np.eye(R))
+    factors = [np.linalg.qr(rng.standard_normal((s, R)))[0].dot(L.T) for s in shape]
+    letters = 'abcd'[:len(shape)]
+    T = np.einsum(','.join(c + 'r' for c in letters) + '->' + letters, *factors)
+    return T, [rng.random_sample((s, R)) for s in shape]
+
+
+def _final_residual(optimizer, tenpy, T, num_iter):
+    res_engine = CP_ResidualEngine(tenpy, T)
+    for _ in range(num_iter):
+        res = res_engine.get_residual(optimizer.A, optimizer.mttkrp, optimizer.gram)
+        optimizer.record_fitness(1 - res / res_engine.normT)
+        optimizer.step(1e-7)
+    return res_engine.get_residual(optimizer.A, optimizer.mttkrp, optimizer.gram)
+
+
+@pytest.mark.parametrize('shape,tol', [((12, 10, 14), 0.1), ((8, 9, 7, 10), 0.2)])
+def test_partial_pp_not_worse_than_pp(tenpy, make_args, shape, tol):
+    T, A = _collinear_problem(shape, 5, 0.5)
+    args = make_args(tol_restart_dt=tol)
+    pp = _final_residual(CP_PPALS_Optimizer(tenpy, T, [a.copy() for a in A], args), tenpy, T, 40)
+    partial = _final_residual(CP_partialPPALS_Optimizer(tenpy, T, [a.copy() for a in A], args),
+                              tenpy, T, 40)
+    assert partial <= pp
+
+
+@pytest.mark.parametrize('optimizer_class', [CP_PPALS_Optimizer, CP_partialPPALS_Optimizer])
+def test_pp_rejects_sparse_tensors(tenpy, make_args, optimizer_class):
+    T = tenpy.sparse_random((6, 7, 8), 1., 1., 0.2)
+    A = [np.ones((s, 2)) for s in T.shape]
+    with pytest.raises(ValueError):
+        optimizer_class(tenpy, T, A, make_args(sp=1))
@@ -0,0 +1,39 @@
+import numpy as np
+
+from CPD.common_kernels import get_residual
+from CPD.residual import CP_ResidualEngine
+
+
+def _count_explicit(engine):
+    calls = []
+    explicit = engine.explicit_residual
+
+    def counted(A):
+        calls.append(1)
+        return explicit(A)
+    engine.explicit_residual = counted
+    return calls
+
+
+def test_gram_identity_near_convergence(tenpy):
+    rng = np.random.RandomState(1)
+    A = [rng.random_sample((s, 3)) for s in (9, 5, 7, 6)]
+    exact = np.einsum('ir,jr,kr,lr->ijkl', *A)
+    # residual of about 1e-6 ||T||, well fitted but far above roundoff
+    T = exact + 1e-6 * np.linalg.norm(exact) / np.sqrt(exact.size) * rng.standard_normal(exact.shape)
+    engine = CP_ResidualEngine(tenpy, T)
+    calls = _count_explicit(engine)
+    res = engine.get_residual(A)
+    assert not calls
+    assert np.isclose(res, get_residual(tenpy, T, A), rtol=1e-2)
+
+
+def test_explicit_residual_under_roundoff(tenpy):
+    rng = np.random.RandomState(2)
+    A = [rng.random_sample((s, 3)) for s in (6, 7, 5)]
+    T = np.einsum('ir,jr,kr->ijk', *A)
+    engine = CP_ResidualEngine(tenpy, T)
+    calls = _count_explicit(engine)
+    res = engine.get_residual(A)
+    assert calls
+    assert res < 1e-12 * engine.normT
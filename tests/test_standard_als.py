@@ -0,0 +1,65 @@
+import threading
+
+import numpy as np
+import pytest
+
+from CPD.standard_ALS import CP_DTALS_Optimizer, CP_DTLRALS_Optimizer, CP_MSDTALS_Optimizer, \
+    CP_SlicedALS_Optimizer
+
+
+def _run(optimizer, num_iter, Regu=1e-7):
+    for _ in range(num_iter):
+        optimizer.step(Regu)
+    return optimizer.A
+
+
+@pytest.mark.parametrize('mode_order', ['index', 'size'])
+def test_msdt_matches_dt(tenpy, make_args, cp_problem, mode_order):
+    T, A = cp_problem()
+    args = make_args(mode_order=mode_order)
+    dt = _run(CP_DTALS_Optimizer(tenpy, T, [a.copy() for a in A], args), 5)
+    msdt = _run(CP_MSDTALS_Optimizer(tenpy, T, [a.copy() for a in A], args), 5)
+    for X, Y in zip(dt, msdt):
+        assert np.allclose(X, Y, rtol=1e-8, atol=1e-10)
+
+
+@pytest.mark.parametrize('optimizer_class, kwargs', [
+    (CP_MSDTALS_Optimizer, {}),
+    (CP_DTLRALS_Optimizer, {'num_lowr_init_iter': 10}),
+    (CP_SlicedALS_Optimizer, {'num_slices': 3}),
+])
+def test_line_extrapolation_in_every_sweep_scheme(tenpy, make_args, cp_problem, optimizer_class, kwargs):
+    T, A = cp_problem()
+    args = make_args(line_extrapolate=2, **kwargs)
+    dt = CP_DTALS_Optimizer(tenpy, T, [a.copy() for a in A], args)
+    optimizer = optimizer_class(tenpy, T, [a.copy() for a in A], args)
+    for _ in range(4):
+        X, Y = dt.step(1e-7), optimizer.step(1e-7)
+        for x, y in zip(X, Y):
+            assert np.allclose(x, y, rtol=1e-8, atol=1e-10)
+    optimizer.close()
+
+
+@pytest.mark.parametrize('shape', [(9, 5, 7, 6), (5, 6, 7, 9)])
+def test_dtlr_streams_slabs_under_memory_budget(tenpy, make_args, cp_problem, shape):
+    T, A = cp_problem(shape=shape)
+    args = make_args(lr_tol=1e-3, num_lowr_init_iter=1, num_inter_iter=10)
+    in_memory = _run(CP_DTLRALS_Optimizer(tenpy, T, [a.copy() for a in A], args), 4)
+    args.memory_budget = T.nbytes / 3. / 2**20
+    optimizer = CP_DTLRALS_Optimizer(tenpy, T, [a.copy() for a in A], args)
+    assert optimizer.slabs is not None
+    streamed = _run(optimizer, 4)
+    for X, Y in zip(in_memory, streamed):
+        assert np.allclose(X, Y, rtol=1e-8, atol=1e-10)
+
+
+def test_close_releases_threads(tenpy, make_args, cp_problem):
+    T, A = cp_problem()
+    before = threading.active_count()
+    args = make_args(num_slices=3, memory_budget=T.nbytes / 3. / 2**20)
+    optimizer = CP_SlicedALS_Optimizer(tenpy, T, [a.copy() for a in A], args)
+    _run(optimizer, 1)
+    CP_DTALS_Optimizer._sweep(optimizer, 1e-7)
+    assert threading.active_count() > before
+    optimizer.close()
+    assert threading.active_count() == before